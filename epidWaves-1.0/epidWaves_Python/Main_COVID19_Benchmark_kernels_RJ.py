@@ -0,0 +1,64 @@
+# -*- coding: utf-8  -*-
+from myfunctions import *
+import numpy as np
+from time import perf_counter
+
+# Benchmark of the residual and Jacobian kernels on the six-wave fit of
+# the RJ deaths: NumPy batch kernels against the fused kernels compiled
+# by Numba (when it is installed).
+
+df = load_data('COVID19_Data_RJ_Jan_01_2020_to_Dec_31_2021.csv')
+
+#  training data start/end
+TrainDataStart = '2020-04-01'
+TrainDataEnd   = '2021-12-01'
+
+# training data (incidence) and time vector for training
+Data_I_train = df.loc[TrainDataStart:TrainDataEnd]['data_obito'].astype(np.float64).to_numpy()
+time_train = df.loc[TrainDataStart:TrainDataEnd]['time'].astype(np.float64).to_numpy()
+
+# initial guesses of the multi-wave script
+K0   = np.array([ 9700,  4480,  6540,  6360,  8110,  4700])
+r0   = np.array([.053, .027, .052, .065, .032, .051])
+t0   = np.array([  121,   268,   355,   465,   505,   608])
+
+HyperParam = {}
+HyperParam['p'] = MultiWaveLogisticPDF(6).names
+HyperParam['lb'] = np.concatenate((0.5*K0, 0.10*r0, 0.9*t0)).reshape(-1, 1)
+HyperParam['ub'] = np.concatenate((1.5*K0, 10.0*r0, 1.1*t0)).reshape(-1, 1)
+HyperParam['Ns'] = 30
+HyperParam['seed'] = 1
+HyperParam['engine'] = 'batch'
+
+# batch of parameter vectors for the kernel timings
+P = RegressionMC_x0(HyperParam['lb'], HyperParam['ub'], HyperParam['Ns'], seed=1, sampler='sobol').T
+
+print("-----------------------")
+print('Numba: ' + ('installed' if numba is not None else 'not installed, NumPy fallback'))
+for backend in ['numpy', 'numba']:
+    HyperParam['backend'] = backend
+
+    # warm-up (compilation of the fused kernel)
+    RegressionMC(time_train, Data_I_train, Model(LogisticPDF6w), dict(HyperParam, Ns=1))
+
+    # residuals, sums of squares and Jacobian of the whole batch
+    fused = RegressionMC_fused(Model(LogisticPDF6w), HyperParam)
+    tstart = perf_counter()
+    for n in range(0, 20):
+        if fused is None:
+            f, J = LogisticPDF6w_batch(time_train, P)
+            cost = np.sum((f - Data_I_train) ** 2, axis=1)
+        else:
+            res, cost, J = fused(time_train, P, Data_I_train)
+    t_kernel = (perf_counter() - tstart) / 20
+
+    # whole Monte Carlo fit
+    tstart = perf_counter()
+    Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, Model(LogisticPDF6w), HyperParam)
+    t_fit = perf_counter() - tstart
+
+    print('backend= ' + ErrorObj_I['backend'] +
+          '  kernel= ' + str(np.round(1e3 * t_kernel, 2)) + ' ms' +
+          '  fit= ' + str(np.round(t_fit, 2)) + ' s' +
+          '  RMSE= ' + str(np.round(ErrorObj_I['rmse'], 2)))
+print("-----------------------")
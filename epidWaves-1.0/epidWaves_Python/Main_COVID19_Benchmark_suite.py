@@ -0,0 +1,126 @@
+# -*- coding: utf-8  -*-
+import sys
+import os
+import subprocess
+import matplotlib
+matplotlib.use('Agg')
+from myfunctions import *
+import numpy as np
+import pandas as pd
+
+# Benchmark suite of the pipeline stages on synthetic epidemics of
+# growing size:
+#
+#   python Main_COVID19_Benchmark_suite.py [version label]
+#
+# Every stage is timed through the telemetry hooks and appended to
+# benchmarks/results.jsonl with the version label (default: the git
+# commit), so that runs of different versions can be compared.
+
+# problem sizes: years of data, number of waves, number of regions
+sizes = [{'years': 2, 'waves': 6, 'regions': 1},
+         {'years': 10, 'waves': 20, 'regions': 1},
+         {'years': 2, 'waves': 6, 'regions': 100},
+         {'years': 5, 'waves': 10, 'regions': 1000}]
+
+# number of initial guesses of the fits
+Ns = 10
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        version = sys.argv[1]
+    else:
+        try:
+            version = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                     capture_output=True, text=True).stdout.strip() or 'unknown'
+        except OSError:
+            version = 'unknown'
+
+    output_dir = 'benchmarks'
+    os.makedirs(output_dir, exist_ok=True)
+    results_file = os.path.join(output_dir, 'results.jsonl')
+    telemetry_setup(results_file)
+    graph_setup(headless=True)
+
+    for size in sizes:
+        tag = dict(size, version=version)
+        case_name = 'synthetic_' + str(size['years']) + 'y_' + str(size['waves']) + 'w_' + str(size['regions']) + 'r'
+        file_name = os.path.join(output_dir, case_name + '.csv')
+        print('benchmark: ' + case_name)
+
+        with telemetry_stage('synthetic_data', **tag):
+            synthetic_data(file_name, years=size['years'], n_waves=size['waves'],
+                           regions=size['regions'], noise='negbin', seed=1)
+
+        if size['regions'] > 1:
+            # panel: one LogisticPDF per region, around its highest peak
+            with telemetry_stage('load_panel', **tag):
+                Data = load_panel(file_name, region='region', series='data_obito')
+            time = np.arange(1, Data.shape[1] + 1)
+            Data_MA = Data.T.rolling(7, center=True, min_periods=1).mean().T.to_numpy()
+            HyperParam = {}
+            HyperParam['tau'] = time[np.argmax(Data_MA, axis=1)]
+            HyperParam['lb'] = np.vstack((0.1 * Data.sum(axis=1), np.full(len(Data), 0.01)))
+            HyperParam['ub'] = np.vstack((1.0 * Data.sum(axis=1), np.full(len(Data), 0.5)))
+            HyperParam['Ns'] = Ns
+            HyperParam['seed'] = 1
+            with telemetry_stage('RegressionMC_panel', **tag):
+                RegressionMC_panel(time, Data, Model(LogisticPDF), HyperParam)
+            continue
+
+        with telemetry_stage('load_data', **tag):
+            df = load_data(file_name)
+        load_data(file_name, cache_dir=os.path.join(output_dir, 'cache'))
+        with telemetry_stage('load_data_cached', **tag):
+            df = load_data(file_name, cache_dir=os.path.join(output_dir, 'cache'))
+        Data_I = df['data_obito'].astype(np.float64)
+        time = df['time'].astype(np.float64)
+
+        with telemetry_stage('aggregate_data', **tag):
+            aggregate_data(Data_I, freq='W')
+            aggregate_data(Data_I, freq='EW')
+            aggregate_data(Data_I, freq='M')
+
+        with telemetry_stage('detect_waves', **tag):
+            WaveObj = detect_waves(time, Data_I)
+
+        # multi-wave fit of the whole series
+        MyFunc_I = MultiWaveLogisticPDF(WaveObj['n_waves'])
+        HyperParam = {'p': WaveObj['p'], 'lb': WaveObj['lb'], 'ub': WaveObj['ub'],
+                      'Ns': Ns, 'seed': 1, 'engine': 'batch'}
+        with telemetry_stage('RegressionMC', **tag):
+            Result_I, ErrorObj_I = RegressionMC(time, Data_I, Model(MyFunc_I), HyperParam)
+        p = np.array([Result_I.best_values[name] for name in MyFunc_I.names])
+
+        # information criteria of the largest wave, two months around its peak
+        K, r, tau = MyFunc_I.split(p)
+        n = np.argmax(K)
+        window = ((time > tau[n] - 30) & (time <= tau[n] + 30)).to_numpy()
+        with telemetry_stage('AkaikeBIC_numpy', **tag):
+            AkaikeBIC_numpy(time[window], np.array([K[n], r[n]]), tau=tau[n])
+
+        with telemetry_stage('predband', **tag):
+            predband(time, time, Data_I, p, MyFunc_I, conf=0.95)
+        with telemetry_stage('deltaband', **tag):
+            deltaband(time, deltaband_setup(Result_I), conf=[0.5, 0.95])
+
+        graphobj = {}
+        graphobj['gname'] = os.path.join(output_dir, case_name)
+        graphobj['leg1'] = ' surveillance data'
+        graphobj['leg2'] = ' 7d moving average'
+        graphobj['ymin'] = 0
+        graphobj['ymax'] = 1.1 * Data_I.max()
+        graphobj['ylab'] = 'new reported deaths per day'
+        Data_I_MA = aggregate_data(Data_I, freq='D')['MA']
+        with telemetry_stage('graph_I_raw', **tag):
+            graph_I_raw(df['date'], Data_I, Data_I_MA, graphobj)
+
+    # comparison of the versions (seconds per stage)
+    telemetry_setup(None)
+    results = pd.read_json(results_file, lines=True)
+    results = results[results['kind'] == 'stage'].astype({'years': int, 'waves': int, 'regions': int})
+    table = results.pivot_table(index=['years', 'waves', 'regions', 'stage'], columns='version',
+                                values='wall', aggfunc='min')
+    print("-----------------------")
+    print(table.round(4).to_string())
+    print("-----------------------")
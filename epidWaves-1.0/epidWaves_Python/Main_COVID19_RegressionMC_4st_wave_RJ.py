@@ -5,10 +5,14 @@ from lmfit import Model
 import locale
 locale.setlocale(locale.LC_ALL, 'en_EN.utf8')
 
+# stage timings are appended to the JSON lines file named by the
+# environment variable EPIDWAVES_TELEMETRY (see telemetry_setup)
+
 # simulation information
 case_name = 'COVID19_4st_wave_RJ'
 
-df = load_data('COVID19_Data_RJ_Jan_01_2020_to_Dec_31_2021.csv')
+with telemetry_stage('load_data', case_name=case_name):
+    df = load_data('COVID19_Data_RJ_Jan_01_2020_to_Dec_31_2021.csv')
 
 # raw data start/end
 RawDataStart = '2021-03-01' #426
@@ -80,6 +84,10 @@ HyperParam['lb'] = np.array([[0.5*K0],
 # number of initial guesses to fit the model
 HyperParam['Ns'] = 30
 
+# store of fit results: reruns with the same data and parameters
+# read the fit back instead of refitting
+HyperParam['cache_dir'] = 'cache'
+
 # logistic model for total notifications
 MyModel_C = Model(LogisticCDF)
 
@@ -87,19 +95,18 @@ MyModel_C = Model(LogisticCDF)
 MyModel_I = Model(LogisticPDF)
 
 # incidence curve fitting via Monte Carlo simulation
-Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, MyModel_I, HyperParam)
+with telemetry_stage('RegressionMC', case_name=case_name):
+    Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, MyModel_I, HyperParam)
 K_best = Result_I.best_values['K']
 r_best = Result_I.best_values['r']
 tau_best = Result_I.best_values['tau']
 
-# model PDF
-ModelPDF = LogisticPDF_model(tau)
-
 # initial guess for MLE estimator
 p0 = np.array([K_best, r_best])
 
 # Akaike and Bayesian information criteria
-[AIC, BIC] = AkaikeBIC(ModelPDF, time_train, p0)
+with telemetry_stage('AkaikeBIC_numpy', case_name=case_name):
+    [AIC, BIC] = AkaikeBIC_numpy(time_train, p0, tau=tau)
 
 # parameters
 print("-----------------------")
@@ -118,7 +125,8 @@ MyFit_C_pred = LogisticCDF(time, K_best, r_best, tau)
 
 # confidence envelope
 p = np.array([K_best, r_best, tau_best])
-MyFit_I_env_lower, MyFit_I_env_upper = predband(time, time_train, Data_I_train, p, LogisticPDF, conf=0.95)
+with telemetry_stage('predband', case_name=case_name):
+    MyFit_I_env_lower, MyFit_I_env_upper = predband(time, time_train, Data_I_train, p, LogisticPDF, conf=0.95)
 MyFit_C_env_lower, MyFit_C_env_upper = np.cumsum(MyFit_I_env_lower), np.cumsum(MyFit_I_env_upper)
 
 # upper bound estimation for starting date
@@ -139,7 +147,8 @@ graphobj['ymax']   = 15000
 graphobj['xlab']   = []
 graphobj['ylab']   = 'total reported deaths'
 
-graph_C_1w(date, Data_C_raw, Data_C_MA, MyFit_C_env_upper, MyFit_C_env_lower, MyFit_C_pred, graphobj)
+with telemetry_stage('graph_C', case_name=case_name):
+    graph_C_1w(date, Data_C_raw, Data_C_MA, MyFit_C_env_upper, MyFit_C_env_lower, MyFit_C_pred, graphobj)
 
 #  Figure 2 - prevalence
 graphobj['gname'] = str(case_name) + '__I_vs_time_tau_' + str(tau0)
@@ -152,7 +161,8 @@ graphobj['tauh']   = 'left'
 graphobj['xlab']   = []
 graphobj['ylab']   = 'new reported deaths per day'
 
-graph_I_1w(date, Data_I_raw, Data_I_MA, MyFit_I_env_upper, MyFit_I_env_lower, MyFit_I_pred, graphobj)
+with telemetry_stage('graph_I', case_name=case_name):
+    graph_I_1w(date, Data_I_raw, Data_I_MA, MyFit_I_env_upper, MyFit_I_env_lower, MyFit_I_pred, graphobj)
 
 
 
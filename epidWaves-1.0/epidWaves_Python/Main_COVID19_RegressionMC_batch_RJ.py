@@ -0,0 +1,115 @@
+# -*- coding: utf-8  -*-
+import sys
+import os
+import matplotlib
+matplotlib.use('Agg')
+from myfunctions import *
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import locale
+locale.setlocale(locale.LC_ALL, 'en_EN.utf8')
+
+# Fits every epidemic wave listed in a specification file (JSON, TOML
+# or YAML) in one run:
+#
+#   python Main_COVID19_RegressionMC_batch_RJ.py [waves_RJ.json]
+#
+# The surveillance data is loaded once and the waves are fitted
+# concurrently, one per worker process. A summary table and the
+# figures of every wave (in the formats listed in the spec, plus an
+# optional multi-page PDF report) are written to the output directory.
+
+if __name__ == '__main__':
+    # wave specification file
+    spec_file = sys.argv[1] if len(sys.argv) > 1 else 'waves_RJ.json'
+    spec = load_spec(spec_file)
+    waves = spec['waves']
+
+    # output directory
+    output_dir = spec.get('output_dir', 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    # telemetry (JSON lines with per-start records and stage timings)
+    if spec.get('telemetry'):
+        telemetry_setup(os.path.join(output_dir, spec['telemetry']), profile=spec.get('profile', False))
+
+    # new events per day (incidence) and its moving average (7 days),
+    # computed once for all waves
+    with telemetry_stage('load_data'):
+        df = load_data(spec['data_file'], cache_dir=spec.get('cache_dir'))
+    Data_I = df[spec.get('series', 'data_obito')].astype(np.float64)
+    Data_I_MA = aggregate_data(Data_I, freq='D')['MA']
+
+    # shared RegressionMC parameters (Ns, seed, sampler, engine, ...)
+    HyperParam = spec.get('HyperParam', {})
+
+    # incidence curve fitting of all waves in a worker pool
+    with telemetry_stage('fits'), ProcessPoolExecutor(max_workers=spec.get('Nworkers', len(waves))) as pool:
+        WaveObjs = list(pool.map(partial(RegressionMC_wave, Data_I, HyperParam=HyperParam), waves))
+
+    # parameters
+    summary = pd.DataFrame([{'case_name': wave['case_name'],
+                             'K_best': WaveObj['K'],
+                             'r_best': WaveObj['r'],
+                             'tau_best': WaveObj['tau'],
+                             'RMSE': WaveObj['rmse'],
+                             'RSquare': WaveObj['rsquare'],
+                             'AIC': WaveObj['AIC'],
+                             'BIC': WaveObj['BIC'],
+                             'tau_ast': WaveObj['tau_ast']}
+                            for wave, WaveObj in zip(waves, WaveObjs)])
+    summary.to_csv(os.path.join(output_dir, 'waves_summary.csv'), index=False)
+    print("-----------------------")
+    print(summary.to_string(index=False))
+    print("-----------------------")
+
+    # legend labels
+    legend = {}
+    legend['leg1'] = ' surveillance data'
+    legend['leg2'] = ' 7d moving average'
+    legend['leg3'] = ' statistical model'
+    legend['leg4'] = ' 95% confidence   '
+
+    # graph specs of all waves, rendered headless in a worker pool
+    specs = []
+    for wave, WaveObj in zip(waves, WaveObjs):
+        date = pd.Series(WaveObj['date'], index=WaveObj['date'])
+        Data_I_raw = Data_I[WaveObj['date']]
+        Data_C_raw = np.cumsum(Data_I_raw)
+        Data_I_MA_raw = Data_I_MA[WaveObj['date']]
+        Data_C_MA = np.cumsum(Data_I_MA_raw)
+        case_name = wave['case_name']
+        tau = WaveObj['tau']
+
+        #  Figure 1 - prevalence
+        graphobj = dict(legend)
+        graphobj['gname'] = os.path.join(output_dir, str(case_name) + '__C_vs_time_tau_' + str(tau))
+        graphobj['gtitle'] = ''
+        graphobj['ymin']   = 0
+        graphobj['ymax']   = wave.get('C_ymax', 15000)
+        graphobj['xlab']   = []
+        graphobj['ylab']   = 'total reported deaths'
+
+        specs.append((graph_C_1w, (date, Data_C_raw, Data_C_MA, WaveObj['C_upper'], WaveObj['C_lower'], WaveObj['C_pred'], graphobj)))
+
+        #  Figure 2 - incidence
+        graphobj = dict(legend)
+        graphobj['gname'] = os.path.join(output_dir, str(case_name) + '__I_vs_time_tau_' + str(tau))
+        graphobj['gtitle'] = ''
+        graphobj['ymin']   = 0
+        graphobj['ymax']   = wave.get('I_ymax', 160)
+        graphobj['taux']   = WaveObj['tau_ast'] if WaveObj['tau_ast'] is not None else date.iloc[0]
+        graphobj['tauy']   = wave.get('tauy', 0.55)
+        graphobj['tauh']   = wave.get('tauh', 'left')
+        graphobj['xlab']   = []
+        graphobj['ylab']   = 'new reported deaths per day'
+
+        specs.append((graph_I_1w, (date, Data_I_raw, Data_I_MA_raw, WaveObj['I_upper'], WaveObj['I_lower'], WaveObj['I_pred'], graphobj)))
+
+    pdf_file = spec.get('pdf_file')
+    with telemetry_stage('graphs'):
+        graph_render(specs, Nworkers=spec.get('Nworkers', len(waves)),
+                     formats=spec.get('formats', ['png']),
+                     pdf_file=os.path.join(output_dir, pdf_file) if pdf_file else None)
@@ -7,10 +7,14 @@ from scipy.optimize import curve_fit
 import locale
 locale.setlocale(locale.LC_ALL, 'en_EN.utf8')
 
+# stage timings are appended to the JSON lines file named by the
+# environment variable EPIDWAVES_TELEMETRY (see telemetry_setup)
+
 # simulation information
 case_name = 'COVID19_multi_waves_RJ'
 
-df = load_data('COVID19_Data_RJ_Jan_01_2020_to_Dec_31_2021.csv')
+with telemetry_stage('load_data', case_name=case_name):
+    df = load_data('COVID19_Data_RJ_Jan_01_2020_to_Dec_31_2021.csv')
 
 # raw data start/end
 RawDataStart = '2020-01-01' #1
@@ -59,54 +63,93 @@ Data_C_MA = np.cumsum(Data_I_MA)
 # 3 - this choice is often trial and error game!
 # 4 - need to be changed for every new dataset!
 
-K0   = [ 9700,  4480,  6540,  6360,  8110,  4700]
-r0   = [.053, .027, .052, .065, .032, .051]
-t0 = [  121,   268,   355,   465,   505,   608]
+K0   = np.array([ 9700,  4480,  6540,  6360,  8110,  4700])
+r0   = np.array([.053, .027, .052, .065, .032, .051])
+t0   = np.array([  121,   268,   355,   465,   505,   608])
 
 # starting dates of the epidemic waves
 #tau_ast = [60, 188, 300, 416, 430, 545]
 tau_ast = ['2020-02-28', '2020-07-06', '2020-10-26', '2021-02-19', '2021-05-03', '2021-06-28']
 
+# automatic alternative to the choices above: waves, initial guesses and
+# starting dates detected from the 7-day moving average (see detect_waves)
+auto_waves = False
+if auto_waves:
+    WaveObj = detect_waves(time, Data_I_raw)
+    K0, r0, t0, tau_ast = WaveObj['K0'], WaveObj['r0'], WaveObj['t0'], WaveObj['tau_ast']
+
+# number of epidemic waves
+n_waves = len(K0)
+
+# logistic model with n_waves waves
+MyFunc_I = MultiWaveLogisticPDF(n_waves)
+
 HyperParam = {}
-# range of admissible values for model parameters
-HyperParam['p'] = ['K1', 'K2', 'K3', 'K4', 'K5', 'K6', 'r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'tau1', 'tau2', 'tau3', 'tau4', 'tau5', 'tau6']
-HyperParam['lb'] = np.array([[0.5*K0[0]], [0.5*K0[1]], [0.5*K0[2]], [0.5*K0[3]], [0.5*K0[4]], [0.5*K0[5]],
-                             [0.10*r0[0]],[0.10*r0[1]],[0.10*r0[2]],[0.10*r0[3]],[0.10*r0[4]],[0.10*r0[5]],
-                             [0.9*t0[0]], [0.9*t0[1]], [0.9*t0[2]], [0.9*t0[3]], [0.9*t0[4]], [0.9*t0[5]]
-                             ], dtype=np.float64)
-HyperParam['ub'] = np.array([[1.5*K0[0]], [1.5*K0[1]], [1.5*K0[2]], [1.5*K0[3]], [1.5*K0[4]], [1.5*K0[5]],
-                             [10.0*r0[0]],[10.0*r0[1]],[10.0*r0[2]],[10.0*r0[3]],[10.0*r0[4]],[10.0*r0[5]],
-                             [1.1*t0[0]], [1.1*t0[1]], [1.1*t0[2]], [1.1*t0[3]], [1.1*t0[4]], [1.1*t0[5]]
-                             ], dtype=np.float64)
+# range of admissible values for model parameters (K1..Kn, r1..rn, tau1..taun)
+HyperParam['p'] = MyFunc_I.names
+HyperParam['lb'] = np.concatenate((0.5*K0, 0.10*r0, 0.9*t0)).reshape(-1, 1)
+HyperParam['ub'] = np.concatenate((1.5*K0, 10.0*r0, 1.1*t0)).reshape(-1, 1)
+if auto_waves:
+    # tau within the segment of every detected wave
+    HyperParam['lb'], HyperParam['ub'] = WaveObj['lb'], WaveObj['ub']
 
 # number of initial guesses to fit the model
 HyperParam['Ns'] = 30
 
+# store of fit results: reruns with the same data and parameters
+# read the fit back instead of refitting
+HyperParam['cache_dir'] = 'cache'
+
+# sampler of the initial guesses: 'legacy', 'uniform', 'sobol', 'halton' or 'lhs'
+HyperParam['sampler'] = 'legacy'
+
+# number of parallel workers for the Monte Carlo fits (1 = serial)
+HyperParam['Nworkers'] = 1
+
+# fitting engine: 'lmfit' (one start at a time), 'batch' (all starts at once)
+# or 'de' (differential evolution of the starts, Ns of 5-10 x parameters)
+HyperParam['engine'] = 'lmfit'
+
 # logistic model for new notifications per day
-MyModel_I = Model(LogisticPDF6w)
+MyModel_I = Model(MyFunc_I)
 
 # incidence curve fitting via Monte Carlo simulation
-Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, MyModel_I, HyperParam)
+with telemetry_stage('RegressionMC', case_name=case_name):
+    Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, MyModel_I, HyperParam)
+
+# initial guess for MLE estimator
+p0 = np.array([Result_I.best_values[name] for name in MyFunc_I.names])
+
+# Akaike and Bayesian information criteria
+with telemetry_stage('AkaikeBIC_numpy', case_name=case_name):
+    [AIC, BIC] = AkaikeBIC_numpy(time_train, p0)
 
 # parameters
 print("-----------------------")
 print('RMSE= ' + str(np.round(ErrorObj_I['rmse'], 1)))
 print('RSquare= ' + str(np.round(ErrorObj_I['rsquare'], 2)))
+print('AIC= ' + str(np.round(AIC, 2)))
+print('BIC= ' + str(np.round(BIC, 2)))
 print("-----------------------")
 
 # evaluate the model
-p = Result_I.best_values
-MyFit_I_pred = LogisticPDF6w(time,
-                             p['K1'], p['K2'], p['K3'], p['K4'], p['K5'], p['K6'],
-                             p['r1'], p['r2'], p['r3'], p['r4'], p['r5'], p['r6'],
-                             p['tau1'], p['tau2'], p['tau3'], p['tau4'], p['tau5'], p['tau6'])
+MyFit_I_pred = MyFunc_I(time, **Result_I.best_values)
 
 # confidence envelope
-p = np.array([p['K1'], p['K2'], p['K3'], p['K4'], p['K5'], p['K6'],
-              p['r1'], p['r2'], p['r3'], p['r4'], p['r5'], p['r6'],
-              p['tau1'], p['tau2'], p['tau3'], p['tau4'], p['tau5'], p['tau6']])
+p = np.array([Result_I.best_values[name] for name in MyFunc_I.names])
+
+with telemetry_stage('predband', case_name=case_name):
+    MyFit_I_env_lower, MyFit_I_env_upper = predband(time, time_train, Data_I_train, p, MyFunc_I, conf=0.95)
 
-MyFit_I_env_lower, MyFit_I_env_upper = predband(time, time_train, Data_I_train, p, LogisticPDF6w, conf=0.95)
+# Bayesian alternative: posterior predictive envelope of an ensemble MCMC
+# calibration started at the fit (see RegressionMC_mcmc and mcmcband)
+mcmc_band = False
+if mcmc_band:
+    with telemetry_stage('RegressionMC_mcmc', case_name=case_name):
+        MCMCObj = RegressionMC_mcmc(time_train, Data_I_train, MyModel_I,
+                                    dict(HyperParam, likelihood='negbin'), p0=Result_I.best_values)
+    with telemetry_stage('mcmcband', case_name=case_name):
+        MyFit_I_env_lower, MyFit_I_env_upper = mcmcband(time, MCMCObj, conf=0.95)
 
 # legend labels
 graphobj = {}
@@ -116,7 +159,7 @@ graphobj['leg3'] = ' statistical model'
 graphobj['leg4'] = ' 95% confidence   '
 
 #  Figure 1 - prevalence
-graphobj['gname'] = str(case_name) + '__I_vs_time_6w'
+graphobj['gname'] = str(case_name) + '__I_vs_time_' + str(n_waves) + 'w'
 graphobj['gtitle'] = ''
 graphobj['ymin']   = 0
 graphobj['ymax']   = 200
@@ -124,7 +167,8 @@ graphobj['tauy']   = 0.5
 graphobj['xlab']   = []
 graphobj['ylab']   = 'new reported deaths per day'
 
-graph_I_6w(date, Data_I_raw, Data_I_MA, MyFit_I_env_upper, MyFit_I_env_lower, MyFit_I_pred, tau_ast, graphobj)
+with telemetry_stage('graph_I', case_name=case_name):
+    graph_I_6w(date, Data_I_raw, Data_I_MA, MyFit_I_env_upper, MyFit_I_env_lower, MyFit_I_pred, tau_ast, graphobj)
 
 
 
@@ -23,34 +23,34 @@ time_Deaths = df.set_index('time')['data_obito']
 time = df.loc[RawDataStart:RawDataEnd]['time'].astype(np.int32)
 date = df.loc[RawDataStart:RawDataEnd]['date']
 
-#cumulative number of events (prevalence)
-Data_Cases_cum = np.cumsum(Data_Cases)
-Data_Deaths_cum = np.cumsum(Data_Deaths)
+# number of new events per week (incidence), cumulative number of
+# events (prevalence) and moving averages (7 days / 7 weeks) to remove
+# fluctuations
+Cases_d  = aggregate_data(Data_Cases, freq='D')
+Deaths_d = aggregate_data(Data_Deaths, freq='D')
+Cases_w  = aggregate_data(Data_Cases, freq='W')
+Deaths_w = aggregate_data(Data_Deaths, freq='W')
 
-# number of new events per week (incidence)
-Data_Cases_w  = pd.DataFrame(data={'cases':np.zeros(2*52)})
-Data_Deaths_w = pd.DataFrame(data={'deaths':np.zeros(2*52)})
+Data_Cases_cum  = Cases_d['cum']
+Data_Deaths_cum = Deaths_d['cum']
 
-for id in range(0, 2*52):
-    Data_Cases_w['cases'][id]  = Data_Cases[id*7:id*7+7].sum()
-    Data_Deaths_w['deaths'][id] = Data_Deaths[id*7:id*7+7].sum()
+Data_Cases_w  = Cases_w['new']
+Data_Deaths_w = Deaths_w['new']
 
-# cumulative number of events (prevalence)
-Data_Cases_cum_w = np.cumsum(Data_Cases_w['cases'])
-Data_Deaths_cum_w = np.cumsum(Data_Deaths_w['deaths'])
+Data_Cases_cum_w  = Cases_w['cum']
+Data_Deaths_cum_w = Deaths_w['cum']
 
-# moving average (7 days) to remove fluctuations
-Data_Cases_MA = df.loc[RawDataStart:RawDataEnd]['data_inicio_sintomas'].rolling(7).mean()
-Data_Deaths_MA = df.loc[RawDataStart:RawDataEnd]['data_obito'].rolling(7).mean()
+Data_Cases_MA  = Cases_d['MA']
+Data_Deaths_MA = Deaths_d['MA']
 
-Data_Cases_cum_MA  = np.cumsum(Data_Cases_MA)
-Data_Deaths_cum_MA = np.cumsum(Data_Deaths_MA)
+Data_Cases_cum_MA  = Cases_d['cum_MA']
+Data_Deaths_cum_MA = Deaths_d['cum_MA']
 
-Data_Cases_MA_w  = Data_Cases_w['cases'].rolling(7).mean()
-Data_Deaths_MA_w = Data_Deaths_w['deaths'].rolling(7).mean()
+Data_Cases_MA_w  = Cases_w['MA']
+Data_Deaths_MA_w = Deaths_w['MA']
 
-Data_Cases_cum_MA_w  = np.cumsum(Data_Cases_MA_w)
-Data_Deaths_cum_MA_w = np.cumsum(Data_Deaths_MA_w)
+Data_Cases_cum_MA_w  = Cases_w['cum_MA']
+Data_Deaths_cum_MA_w = Deaths_w['cum_MA']
 
 graphobj = {}
 # Figure 1 - incidence cases
@@ -4,26 +4,290 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import matplotlib.dates as mdates
-from lmfit import Parameters
+import lmfit
+from lmfit import Model, Parameters
+from lmfit.model import ModelResult
 import sklearn.metrics as metrics
 import sympy as sym
 from sympy import symbols, lambdify, hessian, Matrix, ordered
 from scipy import optimize
+from scipy.special import expit, logsumexp, gammaln
+from scipy.stats import qmc
 from pandas.plotting import deregister_matplotlib_converters
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+from contextlib import contextmanager
+import cProfile
+import inspect
+import warnings
+import hashlib
+import io
+import json
+import os
+import re
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
-def load_data(file_name):
-    custom_date_parser = lambda x: datetime.strptime(x, "%m/%d/%y")
-    df = pd.read_csv(file_name,
-                     parse_dates=['data'],
-                     date_parser=custom_date_parser)
+# -------------------------------------
+#  Telemetry: records appended as JSON lines to the file named by the
+#  environment variable EPIDWAVES_TELEMETRY, so worker processes inherit
+#  it; when disabled every hook costs a single dict lookup
+_TELEMETRY = {'file': os.environ.get('EPIDWAVES_TELEMETRY') or None,
+              'profile': os.environ.get('EPIDWAVES_PROFILE') == '1',
+              'profiling': False}
+
+
+def telemetry_setup(file_name=None, profile=False):
+    #  This routine enables or disables the telemetry.
+    #  Input:
+    #  file_name - JSON lines file of the records (None disables)
+    #  profile   - capture a cProfile summary of every stage
+    _TELEMETRY['file'] = file_name
+    _TELEMETRY['profile'] = bool(profile)
+    if file_name is None:
+        os.environ.pop('EPIDWAVES_TELEMETRY', None)
+    else:
+        os.environ['EPIDWAVES_TELEMETRY'] = file_name
+    os.environ['EPIDWAVES_PROFILE'] = '1' if profile else '0'
+    return
+
+
+def telemetry_record(kind, **fields):
+    #  This routine appends a record to the telemetry file.
+    #  Input:
+    #  kind   - record type, e.g. 'start' or 'stage'
+    #  fields - record contents
+    if _TELEMETRY['file'] is None:
+        return
+    record = {'kind': kind, 'time': datetime.now().isoformat(), 'pid': os.getpid()}
+    record.update(fields)
+    with open(_TELEMETRY['file'], 'a') as f:
+        f.write(json.dumps(record, default=_telemetry_json) + '\n')
+
+
+@contextmanager
+def telemetry_stage(name, **fields):
+    #  This routine times a pipeline stage and records it, with its
+    #  cProfile summary when profiling is on:
+    #  with telemetry_stage('load_data'):
+    #      df = load_data(file_name)
+    if _TELEMETRY['file'] is None:
+        yield
+        return
+    profiler = None
+    if _TELEMETRY['profile'] and not _TELEMETRY['profiling']:
+        # stages nested in a profiled stage are only timed
+        profiler = cProfile.Profile()
+        _TELEMETRY['profiling'] = True
+        profiler.enable()
+    tstart = perf_counter()
+    try:
+        yield
+    finally:
+        fields['wall'] = perf_counter() - tstart
+        if profiler is not None:
+            profiler.disable()
+            _TELEMETRY['profiling'] = False
+            fields['profile'] = telemetry_profile(profiler)
+        telemetry_record('stage', stage=name, **fields)
+
+
+def telemetry_profile(profiler, Nrows=20):
+    #  This routine summarizes a cProfile run: the Nrows functions with
+    #  the largest cumulative time.
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:Nrows]
+    return [{'function': file + ':' + str(line) + '(' + func + ')',
+             'ncalls': nc, 'tottime': tt, 'cumtime': ct}
+            for (file, line, func), (cc, nc, tt, ct, callers) in rows]
+
+
+def _telemetry_json(value):
+    #  JSON form of NumPy values and dates in the records
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def load_data(file_name, cache_dir=None, cache_size=256 * 2 ** 20):
+    #  This routine loads the surveillance data file, indexed by date.
+    #  Input:
+    #  file_name  - CSV file with the columns data (dates as m/d/y),
+    #               data_notificacao, data_inicio_sintomas and data_obito
+    #  cache_dir  - directory of the on-disk cache of parsed files
+    #               (optional); the columns are stored as binary arrays,
+    #               keyed by the file contents and modification time, so
+    #               later loads skip the CSV parsing
+    #  cache_size - maximum size of the cache in bytes
+    #  Output:
+    #  df - data frame with the file columns plus time (1, 2, ...) and date
+    with open(file_name, 'rb') as f:
+        raw = f.read()
+
+    if cache_dir is not None:
+        digest = hashlib.sha256(raw)
+        digest.update(str(os.stat(file_name).st_mtime_ns).encode())
+        key = digest.hexdigest() + '-data.npz'
+        data = cache_load(cache_dir, key)
+        if data is not None:
+            with np.load(io.BytesIO(data)) as arrays:
+                return _load_data_frame({name: arrays[name] for name in arrays.files})
+
+    df = pd.read_csv(io.BytesIO(raw), encoding='utf-8-sig')
+    missing = [name for name in ('data', 'data_notificacao', 'data_inicio_sintomas', 'data_obito')
+               if name not in df.columns]
+    if missing:
+        raise ValueError(file_name + ': missing columns ' + ', '.join(missing))
+
+    columns = {}
+    for name in df.columns:
+        column = df[name].to_numpy()
+        columns[name] = column.astype(str) if column.dtype == object else column
+    columns['data'] = pd.to_datetime(df['data'], format='%m/%d/%y').to_numpy()
+
+    if cache_dir is not None:
+        buffer = io.BytesIO()
+        np.savez(buffer, **columns)
+        cache_save(cache_dir, key, buffer.getvalue(), cache_size)
+    return _load_data_frame(columns)
+
+
+def _load_data_frame(columns):
+    #  This routine builds the data frame of load_data from its columns.
+    df = pd.DataFrame(columns)
     df['time'] = np.arange(1, len(df['data']) + 1, 1)
-    df['data'] = pd.to_datetime(df['data'], format='%Y-%m-%d')
     df['date'] = df['data']
     df = df.set_index('data')
     return df
 
 
+def load_panel(file_name, region='region', series='data_obito', date_format='%m/%d/%y'):
+    #  This routine loads a long-format surveillance file of many regions
+    #  (one row per region and date) into a compact regions x days table.
+    #  Input:
+    #  file_name   - CSV file with the columns data (dates), the region key
+    #                and the series
+    #  region      - name of the region key column
+    #  series      - name of the series column
+    #  date_format - format of the dates
+    #  Output:
+    #  Data - new events per day (regions x days), indexed by region and
+    #         by date over the whole period; missing days are zero
+    df = pd.read_csv(file_name, encoding='utf-8-sig', usecols=['data', region, series])
+    iregion, regions = pd.factorize(df[region], sort=True)
+
+    # every distinct date string is parsed once
+    idate, date = pd.factorize(df['data'])
+    date = pd.to_datetime(date, format=date_format)
+    dates = pd.date_range(date.min(), date.max(), freq='D')
+    iday = ((date - dates[0]) // pd.Timedelta(days=1)).to_numpy()[idate]
+
+    Y = np.zeros((len(regions), len(dates)))
+    np.add.at(Y, (iregion, iday), df[series].to_numpy(dtype=np.float64))
+    return pd.DataFrame(Y, index=pd.Index(regions, name=region), columns=dates)
+
+
+def synthetic_data(file_name=None, years=2, n_waves=6, regions=1, noise='poisson', dispersion=10.0,
+                   weekday=(1.10, 1.10, 1.05, 1.05, 1.00, 0.85, 0.85), start='2020-01-01', seed=None):
+    #  This routine generates synthetic surveillance data, sums of logistic
+    #  waves with count noise and weekday reporting effects, in the column
+    #  layout of the RJ data file.
+    #  Input:
+    #  file_name  - CSV file to write (optional)
+    #  years      - length of the series in years
+    #  n_waves    - number of epidemic waves
+    #  regions    - number of regions; with more than one, the file is in
+    #               the long format of load_panel (column region)
+    #  noise      - 'poisson' or 'negbin' (negative binomial) counts
+    #  dispersion - dispersion of the negative binomial counts
+    #  weekday    - reporting factors from Monday to Sunday
+    #  start      - first date
+    #  seed       - seed of the random generator
+    #  Output:
+    #  df    - data frame with the columns data (m/d/y), data_notificacao,
+    #          data_inicio_sintomas, data_obito (and region)
+    #  truth - wave parameters K, r, tau of every region (regions x n)
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=int(round(365.25 * years)), freq='D')
+    T = len(dates)
+    time = np.arange(1, T + 1, dtype=np.float64)
+
+    # waves spread over the period, with region-specific sizes and speeds
+    tau = np.sort(rng.uniform(0.05, 0.95, (regions, n_waves)) * T, axis=1)
+    K = rng.uniform(2e3, 1e4, (regions, n_waves)) * rng.lognormal(0, 1, (regions, 1))
+    r = rng.uniform(0.03, 0.08, (regions, n_waves))
+    deaths, J = LogisticWaves_batch(time, K, r, tau, jac=False)
+
+    # symptom onsets precede the deaths by 14 days and the notifications
+    # follow the onsets by 5 days
+    onsets, J = LogisticWaves_batch(time + 14, 30 * K, r, tau, jac=False)
+    notified, J = LogisticWaves_batch(time + 9, 24 * K, r, tau, jac=False)
+    factor = np.asarray(weekday)[dates.dayofweek]
+
+    def counts(mu):
+        mu = mu * factor
+        if noise == 'negbin':
+            return rng.negative_binomial(dispersion, dispersion / (dispersion + mu))
+        return rng.poisson(mu)
+
+    df = pd.DataFrame({'data': np.tile(dates.strftime('%m/%d/%y'), regions),
+                       'data_notificacao': counts(notified).ravel(),
+                       'data_inicio_sintomas': counts(onsets).ravel(),
+                       'data_obito': counts(deaths).ravel()})
+    if regions > 1:
+        df.insert(1, 'region', np.repeat(['R' + str(n).zfill(len(str(regions))) for n in range(regions)], T))
+    if file_name is not None:
+        df.to_csv(file_name, index=False)
+    return df, {'K': K, 'r': r, 'tau': tau}
+
+
+def aggregate_data(Data, freq='W', window=7):
+    #  This routine aggregates daily counts into totals per period, together
+    #  with their cumulative and moving-average series, in one vectorized
+    #  pass.
+    #  Input:
+    #  Data   - new events per day, a Series or a DataFrame with one
+    #           column per series (e.g. per region), indexed by date
+    #  freq   - aggregation period:
+    #           'D'  - days (no aggregation)
+    #           'W'  - consecutive 7-day blocks from the first date (an
+    #                  incomplete last block is dropped)
+    #           'EW' - epidemiological weeks (Sunday to Saturday, labelled
+    #                  by the Saturday)
+    #           'M'  - calendar months
+    #  window - moving-average window, in periods
+    #  Output:
+    #  AggObj - dict with the series (or data frames) new (events per
+    #           period), cum (cumulative events), MA (moving average of
+    #           new) and cum_MA (cumulative moving average)
+    if freq == 'D':
+        new = Data
+    elif freq == 'W':
+        Nw = len(Data) // 7
+        values = np.asarray(Data, dtype=np.float64)[:7 * Nw]
+        values = values.reshape((Nw, 7) + values.shape[1:]).sum(axis=1)
+        if isinstance(Data, pd.DataFrame):
+            new = pd.DataFrame(values, index=Data.index[:7 * Nw:7], columns=Data.columns)
+        else:
+            new = pd.Series(values, index=Data.index[:7 * Nw:7], name=Data.name)
+    elif freq == 'EW':
+        new = Data.resample('W-SAT').sum()
+    elif freq == 'M':
+        new = Data.resample('MS').sum()
+    else:
+        raise ValueError('unknown aggregation period ' + str(freq))
+
+    AggObj = {}
+    AggObj['new'] = new
+    AggObj['cum'] = new.cumsum()
+    AggObj['MA'] = new.rolling(window).mean()
+    AggObj['cum_MA'] = AggObj['MA'].cumsum()
+    return AggObj
+
+
 def LogisticPDF(x, K, r, tau):
     #  This routine defines the logistic function derivative.
     #  Input:
@@ -33,7 +297,34 @@ def LogisticPDF(x, K, r, tau):
     #  tau - point of inflection
     #  Output:
     #  logistic function derivative value
-    return r * K * np.exp(-r * (x - tau)) / (1 + np.exp(-r * (x - tau))) ** 2
+    #  (the exponential is taken of -|r*(x - tau)|, so it never overflows;
+    #  see LogisticPDF_kernel for preallocated output and float32)
+    e = np.exp(-np.abs(r * (x - tau)))
+    return r * K * e / (1 + e) ** 2
+
+
+def LogisticPDF_kernel(x, K, r, tau, out=None, dtype=None):
+    #  This routine evaluates the logistic function derivative in place.
+    #  The exponential is taken once, of -|r*(x - tau)|, so it never
+    #  overflows for steep r or far-off tau. (LogisticPDF keeps the plain
+    #  signature, since lmfit would take out and dtype for independent
+    #  variables.)
+    #  Input:
+    #  x     - independent variable
+    #  K     - curve's maximum value
+    #  r     - growth rate
+    #  tau   - point of inflection
+    #  out   - preallocated output array (optional)
+    #  dtype - floating point type, e.g. np.float32 (default: float64, or
+    #          the type of out)
+    #  Output:
+    #  logistic function derivative value, of the broadcast shape of
+    #  x, K, r and tau
+    dtype = np.dtype(dtype or (out.dtype if out is not None else np.float64))
+    x, K, r, tau = (np.asarray(v, dtype=dtype) for v in (x, K, r, tau))
+    if out is None:
+        out = np.empty(np.broadcast_shapes(x.shape, K.shape, r.shape, tau.shape), dtype=dtype)
+    return _LogisticPDF_waves(x, K, r, tau, out=out)
 
 
 def LogisticPDF6w(x, K1, K2, K3, K4, K5, K6, r1, r2, r3, r4, r5, r6, tau1, tau2, tau3, tau4, tau5, tau6):
@@ -45,13 +336,64 @@ def LogisticPDF6w(x, K1, K2, K3, K4, K5, K6, r1, r2, r3, r4, r5, r6, tau1, tau2,
     #  tau - point of inflection
     #  Output:
     #  logistic function derivative value
-    dCdx  = r1 * K1 * np.exp(-r1 * (x - tau1)) / (1 + np.exp(-r1 * (x - tau1))) ** 2
-    dCdx += r2 * K2 * np.exp(-r2 * (x - tau2)) / (1 + np.exp(-r2 * (x - tau2))) ** 2
-    dCdx += r3 * K3 * np.exp(-r3 * (x - tau3)) / (1 + np.exp(-r3 * (x - tau3))) ** 2
-    dCdx += r4 * K4 * np.exp(-r4 * (x - tau4)) / (1 + np.exp(-r4 * (x - tau4))) ** 2
-    dCdx += r5 * K5 * np.exp(-r5 * (x - tau5)) / (1 + np.exp(-r5 * (x - tau5))) ** 2
-    dCdx += r6 * K6 * np.exp(-r6 * (x - tau6)) / (1 + np.exp(-r6 * (x - tau6))) ** 2
-    return dCdx
+    return LogisticPDFnw(x, [K1, K2, K3, K4, K5, K6], [r1, r2, r3, r4, r5, r6],
+                         [tau1, tau2, tau3, tau4, tau5, tau6])
+
+
+def LogisticPDFnw(x, K, r, tau, reduce=True, chunk=4096, out=None, dtype=None):
+    #  This routine defines the sum of n logistic function derivatives.
+    #  Input:
+    #  x      - independent variable
+    #  K      - curves' maximum values (n)
+    #  r      - growth rates (n)
+    #  tau    - points of inflection (n)
+    #  reduce - whether to sum over the waves; the sum is accumulated
+    #           over blocks of chunk times, so the (time x waves)
+    #           intermediate is never allocated in full
+    #  chunk  - number of times per block
+    #  out    - preallocated output array of the sum (optional)
+    #  dtype  - floating point type, e.g. np.float32 (default: float64, or
+    #           the type of out)
+    #  Output:
+    #  logistic function derivative value (shape of x), or the value
+    #  of every wave (len(x) x n) when reduce is False
+    dtype = np.dtype(dtype or (out.dtype if out is not None else np.float64))
+    x = np.asarray(x, dtype=dtype)
+    K = np.asarray(K, dtype=dtype)
+    r = np.asarray(r, dtype=dtype)
+    tau = np.asarray(tau, dtype=dtype)
+    if not reduce:
+        return _LogisticPDF_waves(x.reshape(-1, 1), K, r, tau)
+    if out is None:
+        out = np.empty(x.shape, dtype=dtype)
+    xf, dCdx = x.reshape(-1), out.reshape(-1)
+    # one work buffer, reused by every block
+    work = np.empty((min(chunk, xf.size), K.size), dtype=dtype)
+    for i in range(0, xf.size, chunk):
+        n = min(chunk, xf.size - i)
+        waves = _LogisticPDF_waves(xf[i:i + n, None], K, r, tau, out=work[:n])
+        np.sum(waves, axis=1, out=dCdx[i:i + n])
+    return out
+
+
+def _LogisticPDF_waves(x, K, r, tau, out=None):
+    #  logistic function derivative of every wave, broadcast over x (T x 1)
+    #  and the wave parameters (n), computed in place in out (T x n, or
+    #  any broadcast shape of the arguments); exp(-|z|) keeps it free of
+    #  overflow
+    if out is None:
+        out = np.empty((x.shape[0], K.size), dtype=x.dtype)
+    np.subtract(x, tau, out=out)
+    out *= r
+    np.abs(out, out=out)
+    np.negative(out, out=out)
+    np.exp(out, out=out)
+    # e/(1 + e)^2 with one temporary
+    den = out + 1
+    den *= den
+    np.divide(out, den, out=out)
+    out *= r * K
+    return out
 
 
 def LogisticCDF(x, K, r, tau):
@@ -63,7 +405,304 @@ def LogisticCDF(x, K, r, tau):
     #  tau - point of inflection
     #  Output:
     #  logistic function value
-    return K / (1 + np.exp(-r * (x - tau)))
+    #  (1/(1 + exp(-z)) is taken as (1 + tanh(z/2))/2, which never
+    #  overflows; see LogisticCDF_kernel for preallocated output and float32)
+    return 0.5 * K * (1 + np.tanh(0.5 * r * (x - tau)))
+
+
+def LogisticCDF_kernel(x, K, r, tau, out=None, dtype=None):
+    #  This routine evaluates the logistic function in place, through the
+    #  overflow-safe expit.
+    #  Input:
+    #  x     - independent variable
+    #  K     - curve's maximum value
+    #  r     - growth rate
+    #  tau   - point of inflection
+    #  out   - preallocated output array (optional)
+    #  dtype - floating point type, e.g. np.float32 (default: float64, or
+    #          the type of out)
+    #  Output:
+    #  logistic function value, of the broadcast shape of x, K, r and tau
+    dtype = np.dtype(dtype or (out.dtype if out is not None else np.float64))
+    x, K, r, tau = (np.asarray(v, dtype=dtype) for v in (x, K, r, tau))
+    if out is None:
+        out = np.empty(np.broadcast_shapes(x.shape, K.shape, r.shape, tau.shape), dtype=dtype)
+    np.subtract(x, tau, out=out)
+    out *= r
+    expit(out, out=out)
+    out *= K
+    return out
+
+
+def LogisticPDF_jac(x, K, r, tau):
+    #  This routine defines the Jacobian of the logistic function derivative.
+    #  Input:
+    #  x   - independent variable
+    #  K   - curve's maximum value
+    #  r   - growth rate
+    #  tau - point of inflection
+    #  Output:
+    #  derivatives with respect to K, r and tau (len(x) x 3)
+    x = np.asarray(x, dtype=np.float64)
+    z = r * (x - tau)
+    e = np.exp(-np.abs(z))
+    q = e / (1 + e) ** 2
+    dq = -q * np.tanh(0.5 * z)
+    return np.column_stack((r * q, K * q + r * K * dq * (x - tau), -r ** 2 * K * dq))
+
+
+def LogisticPDF6w_jac(x, K1, K2, K3, K4, K5, K6, r1, r2, r3, r4, r5, r6, tau1, tau2, tau3, tau4, tau5, tau6):
+    #  This routine defines the Jacobian of the six-wave logistic function
+    #  derivative.
+    #  Input:
+    #  x   - independent variable
+    #  K   - curves' maximum values
+    #  r   - growth rates
+    #  tau - points of inflection
+    #  Output:
+    #  derivatives with respect to K1..K6, r1..r6 and tau1..tau6 (len(x) x 18)
+    K = np.array([[K1, K2, K3, K4, K5, K6]], dtype=np.float64)
+    r = np.array([[r1, r2, r3, r4, r5, r6]], dtype=np.float64)
+    tau = np.array([[tau1, tau2, tau3, tau4, tau5, tau6]], dtype=np.float64)
+    return LogisticWaves_batch(x, K, r, tau)[1][0]
+
+
+def LogisticCDF_jac(x, K, r, tau):
+    #  This routine defines the Jacobian of the logistic function.
+    #  Input:
+    #  x   - independent variable
+    #  K   - curve's maximum value
+    #  r   - growth rate
+    #  tau - point of inflection
+    #  Output:
+    #  derivatives with respect to K, r and tau (len(x) x 3)
+    x = np.asarray(x, dtype=np.float64)
+    s = expit(r * (x - tau))
+    q = s * (1 - s)
+    return np.column_stack((s, K * q * (x - tau), -K * r * q))
+
+
+# analytic Jacobians handed to lmfit by RegressionMC
+_JACOBIANS = {LogisticPDF: LogisticPDF_jac,
+              LogisticPDF6w: LogisticPDF6w_jac,
+              LogisticCDF: LogisticCDF_jac}
+
+
+# sign of the lmfit Model residual, found on first use by lmfit_residual_sign
+_LMFIT_SIGN = {}
+
+
+def lmfit_residual_sign():
+    #  This routine finds the sign of the residual of lmfit.Model, which
+    #  changed between lmfit releases: +1 for model - data (up to 1.3.2),
+    #  -1 for data - model. It is probed once, on a one-point model; if the
+    #  probe fails (it uses an internal lmfit method), the sign follows
+    #  from the lmfit version.
+    #  Output:
+    #  sign - +1 or -1
+    if 'sign' not in _LMFIT_SIGN:
+        try:
+            res = Model(LogisticCDF)._residual(Parameters(), np.zeros(1), None,
+                                               x=np.zeros(1), K=1.0, r=0.0, tau=0.0)
+            sign = float(np.sign(res[0]))
+            if sign == 0:
+                raise ValueError('inconclusive residual sign probe')
+        except Exception:
+            version = tuple(int(v) for v in re.findall(r'\d+', lmfit.__version__)[:3])
+            sign = 1.0 if version < (1, 3, 3) else -1.0
+        _LMFIT_SIGN['sign'] = sign
+    return _LMFIT_SIGN['sign']
+
+
+def lmfit_jacobian(jacfun, names, params, data, weights, x=None):
+    #  This routine adapts a model Jacobian to the Dfun interface of lmfit,
+    #  returning the derivatives of the residual with respect to the
+    #  varying parameters, in the order lmfit uses for them.
+    #  Input:
+    #  jacfun  - model Jacobian, jacfun(x, *values) -> (len(x) x p)
+    #  names   - model parameter names, in the order of the jacfun arguments
+    #  params  - lmfit parameters object
+    #  data    - dependent parameter data
+    #  weights - residual weights (or None)
+    #  x       - independent parameter data
+    #  Output:
+    #  Jacobian of the residual (len(x) x number of varying parameters)
+    J = jacfun(x, *[params[name].value for name in names])
+    J = lmfit_residual_sign() * J[:, [names.index(name) for name in params if params[name].vary]]
+    if weights is not None:
+        J = J * np.asarray(weights).reshape(-1, 1)
+    return J
+
+
+def LogisticWaves_batch(x, K, r, tau, jac=True):
+    #  This routine evaluates a sum of logistic function derivatives
+    #  and its Jacobian for a batch of parameter vectors at once.
+    #  Input:
+    #  x   - independent variable (T)
+    #  K   - curves' maximum values (B x n)
+    #  r   - growth rates (B x n)
+    #  tau - points of inflection (B x n)
+    #  jac - whether to compute the Jacobian
+    #  Output:
+    #  f - model values (B x T)
+    #  J - Jacobian with columns K1..Kn, r1..rn, tau1..taun (B x T x 3n)
+    x = np.asarray(x, dtype=np.float64)[None, :, None]
+    K, r, tau = K[:, None, :], r[:, None, :], tau[:, None, :]
+    z = r * (x - tau)
+    e = np.exp(-np.abs(z))
+    q = e / (1 + e) ** 2
+    f = np.sum(r * K * q, axis=2)
+    if not jac:
+        return f, None
+    # derivative of q with respect to z is q*(1 - 2*expit(z))
+    dq = -q * np.tanh(0.5 * z)
+    J = np.concatenate((r * q,
+                        K * q + r * K * dq * (x - tau),
+                        -r ** 2 * K * dq), axis=2)
+    return f, J
+
+
+def LogisticPDF_batch(x, P, jac=True):
+    #  Batch version of LogisticPDF for the columns K, r, tau of P (B x 3).
+    return LogisticWaves_batch(x, P[:, 0:1], P[:, 1:2], P[:, 2:3], jac)
+
+
+def LogisticPDF6w_batch(x, P, jac=True):
+    #  Batch version of LogisticPDF6w for the columns K1..K6, r1..r6,
+    #  tau1..tau6 of P (B x 18).
+    return LogisticWaves_batch(x, P[:, 0:6], P[:, 6:12], P[:, 12:18], jac)
+
+
+# batch kernels used by the native fitting engine of RegressionMC
+_BATCH_KERNELS = {LogisticPDF: LogisticPDF_batch,
+                  LogisticPDF6w: LogisticPDF6w_batch}
+
+
+def LogisticWaves_fused(x, Y, K, r, tau, jac=True):
+    #  This routine evaluates the residuals, sums of squares and Jacobian
+    #  of a batch of sums of logistic function derivatives in one pass.
+    #  With Numba installed the pass is a single compiled loop over the
+    #  batch, time and waves; otherwise it falls back to NumPy.
+    #  Input:
+    #  x   - independent variable (T)
+    #  Y   - data (T) or one dataset per parameter vector (B x T)
+    #  K   - curves' maximum values (B x n)
+    #  r   - growth rates (B x n)
+    #  tau - points of inflection (B x n)
+    #  jac - whether to compute the Jacobian
+    #  Output:
+    #  res  - residuals, model minus data (B x T)
+    #  cost - sums of squared residuals (B)
+    #  J    - Jacobian with columns K1..Kn, r1..rn, tau1..taun (B x T x 3n)
+    if _logistic_waves_jit is None:
+        f, J = LogisticWaves_batch(x, K, r, tau, jac)
+        res = f - Y
+        return res, np.sum(res ** 2, axis=1), J
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    B, n = K.shape
+    Y = np.broadcast_to(np.asarray(Y, dtype=np.float64), (B, x.size))
+    res = np.empty((B, x.size))
+    J = np.empty((B, x.size, 3 * n) if jac else (0, 0, 0))
+    cost = _logistic_waves_jit(x, Y, K, r, tau, res, J, jac)
+    return res, cost, (J if jac else None)
+
+
+def _logistic_waves_loop(x, Y, K, r, tau, res, J, jac):
+    #  fused loop of LogisticWaves_fused, compiled by Numba
+    B, n = K.shape
+    cost = np.zeros(B)
+    for b in range(B):
+        c = 0.0
+        for t in range(x.shape[0]):
+            f = 0.0
+            for w in range(n):
+                dx = x[t] - tau[b, w]
+                z = r[b, w] * dx
+                e = np.exp(-abs(z))
+                q = e / (1.0 + e) ** 2
+                f += r[b, w] * K[b, w] * q
+                if jac:
+                    dq = -q * np.tanh(0.5 * z)
+                    J[b, t, w] = r[b, w] * q
+                    J[b, t, n + w] = K[b, w] * q + r[b, w] * K[b, w] * dq * dx
+                    J[b, t, 2 * n + w] = -r[b, w] ** 2 * K[b, w] * dq
+            d = f - Y[b, t]
+            res[b, t] = d
+            c += d * d
+        cost[b] = c
+    return cost
+
+
+# compiled fused loop, when Numba is installed
+_logistic_waves_jit = numba.njit(cache=True)(_logistic_waves_loop) if numba is not None else None
+
+
+def LogisticPDF_fused(x, P, Y, jac=True):
+    #  Fused version of LogisticPDF for the columns K, r, tau of P (B x 3).
+    return LogisticWaves_fused(x, Y, P[:, 0:1], P[:, 1:2], P[:, 2:3], jac)
+
+
+def LogisticPDF6w_fused(x, P, Y, jac=True):
+    #  Fused version of LogisticPDF6w for the columns K1..K6, r1..r6,
+    #  tau1..tau6 of P (B x 18).
+    return LogisticWaves_fused(x, Y, P[:, 0:6], P[:, 6:12], P[:, 12:18], jac)
+
+
+# fused kernels used by the 'numba' backend of the native fitting engine
+_FUSED_KERNELS = {LogisticPDF: LogisticPDF_fused,
+                  LogisticPDF6w: LogisticPDF6w_fused}
+
+
+class MultiWaveLogisticPDF:
+    #  Sum of n logistic function derivatives with scalar arguments
+    #  K1..Kn, r1..rn, tau1..taun, the form lmfit.Model, RegressionMC
+    #  and predband expect, for any number of waves.
+    #  Usage:
+    #  MyFunc = MultiWaveLogisticPDF(n_waves)
+    #  MyModel = Model(MyFunc)             - lmfit model
+    #  HyperParam['p'] = MyFunc.names      - parameter names
+    #  MyFunc(x, **Result.best_values)     - model evaluation
+    #  MyFunc(x, *p)                       - flat parameter vector p
+    #  K, r, tau = MyFunc.split(p)         - parameter arrays (n)
+    def __init__(self, n_waves):
+        self.n_waves = n_waves
+        self.__name__ = 'LogisticPDF' + str(n_waves) + 'w'
+        self.names = (['K' + str(i) for i in range(1, n_waves + 1)] +
+                      ['r' + str(i) for i in range(1, n_waves + 1)] +
+                      ['tau' + str(i) for i in range(1, n_waves + 1)])
+
+    @property
+    def __signature__(self):
+        # lmfit builds the parameters from the signature
+        return inspect.Signature(
+            [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+             for name in ['x'] + self.names])
+
+    def split(self, p):
+        #  K, r and tau arrays from a flat vector or a dict of values
+        if isinstance(p, dict):
+            p = [p[name] for name in self.names]
+        p = np.asarray(p, dtype=np.float64)
+        n = self.n_waves
+        return p[:n], p[n:2 * n], p[2 * n:3 * n]
+
+    def __call__(self, x, *p, **kws):
+        return LogisticPDFnw(x, *self.split(p if p else kws))
+
+    def jac(self, x, *p, **kws):
+        #  Jacobian with columns K1..Kn, r1..rn, tau1..taun (len(x) x 3n)
+        K, r, tau = self.split(p if p else kws)
+        return LogisticWaves_batch(x, K[None, :], r[None, :], tau[None, :])[1][0]
+
+    def batch(self, x, P, jac=True):
+        #  batch version for the columns K1..Kn, r1..rn, tau1..taun of P
+        n = self.n_waves
+        return LogisticWaves_batch(x, P[:, :n], P[:, n:2 * n], P[:, 2 * n:3 * n], jac)
+
+    def fused(self, x, P, Y, jac=True):
+        #  fused residuals, sums of squares and Jacobian for the rows of P
+        n = self.n_waves
+        return LogisticWaves_fused(x, Y, P[:, :n], P[:, n:2 * n], P[:, 2 * n:3 * n], jac)
 
 
 def RegressionMC(xdata, ydata, MyModel, HyperParam):
@@ -77,9 +716,61 @@ def RegressionMC(xdata, ydata, MyModel, HyperParam):
     #  ydata      - dependent   parameter data
     #  MyModel    - algebraic model structure
     #  HyperParam - algebraic model parameters
+    #  Optional HyperParam entries:
+    #  Nworkers   - number of worker processes (default: 1, serial)
+    #  seed       - seed of the per-start random streams (default: None)
+    #  sampler    - sampler of the initial guesses, see RegressionMC_x0
+    #               (default: 'legacy')
+    #  log_params - names of the parameters sampled log-uniformly,
+    #               e.g. ['r'] (default: none)
+    #  engine     - 'lmfit' (default) fits the starts one by one, 'batch'
+    #               fits all of them at once with RegressionMC_batch, 'de'
+    #               evolves them as the population of a differential
+    #               evolution global search, see RegressionMC_de
+    #  jac        - use the analytic model Jacobian, when there is one
+    #               (default: True)
+    #  backend    - 'numpy' (default) or 'numba': compiled residual and
+    #               Jacobian kernels of the 'batch' engine, used when Numba
+    #               is installed (ErrorObj['backend'] is the one used)
+    #  Adaptive stopping (optional HyperParam entries, 'lmfit' engine):
+    #  stop_window - stop when the best RMSE has not improved by more than
+    #                a fraction stop_tol (default: 1e-6) over this many
+    #                consecutive starts
+    #  stop_Nconv  - stop when this many starts have converged to the best
+    #                parameters within a relative tolerance stop_ptol
+    #                (default: 1e-4)
+    #  time_budget - stop when the fits have taken this many seconds
     #  Output:
     #  Result_last - fitting model object
-    #  ErrorObj - fitting error object
+    #  ErrorObj - fitting error object (ErrorObj['Ns_used'] is the number
+    #             of starts actually used)
+    #  Telemetry:
+    #  with telemetry_setup on, every start is recorded (wall time, nfev,
+    #  convergence, RMSE and initial guess)
+    #  Result cache (optional HyperParam entries):
+    #  cache_dir  - directory of the on-disk store of fit results; a fit
+    #               with the same data, model and HyperParam is read back
+    #               instead of refitted (ErrorObj['cache'] is 'hit' or
+    #               'miss'), see RegressionMC_cache_key
+    #  cache_size - maximum size of the store in bytes (default: 64 MB)
+    #  Remark:
+    #  with Nworkers > 1 the fits run in a process pool, so scripts
+    #  on platforms that spawn processes (Windows, macOS) must call
+    #  RegressionMC under an if __name__ == '__main__' guard.
+
+    # stored result of the same fit
+    cache_dir = HyperParam.get('cache_dir')
+    if cache_dir is not None:
+        key = RegressionMC_cache_key(xdata, ydata, MyModel, HyperParam)
+        cached = RegressionMC_cache_load(cache_dir, key, xdata, ydata, MyModel)
+        if cached is not None:
+            return cached
+        Result_last, ErrorObj = RegressionMC(xdata, ydata, MyModel, dict(HyperParam, cache_dir=None))
+        ErrorObj['cache'] = 'miss'
+        ErrorObj['cache_key'] = key
+        RegressionMC_cache_save(cache_dir, key, Result_last, ErrorObj,
+                                HyperParam.get('cache_size', 64 * 2 ** 20))
+        return Result_last, ErrorObj
 
     # range of admissible values for model parameters
 
@@ -89,45 +780,833 @@ def RegressionMC(xdata, ydata, MyModel, HyperParam):
     # number of samples for Monte Carlo simulation
     Ns = HyperParam['Ns']
 
+    # number of parallel workers
+    Nworkers = HyperParam.get('Nworkers', 1)
+
     ErrorObj = {}
     # estimation for squared sum of errors
     ErrorObj['rmse'] = 10 ** 10
 
+    # sampler of the initial guesses
+    sampler = HyperParam.get('sampler', 'legacy')
+    ErrorObj['sampler'] = sampler
+
     # ensemble of random initial guesses
-    x0 = lb + (ub - lb) * np.random.rand(1, Ns)
+    log = [name in HyperParam.get('log_params', []) for name in RegressionMC_names(HyperParam)]
+    x0 = RegressionMC_x0(lb, ub, Ns, HyperParam.get('seed'), sampler, log)
+
+    # native engine: all starts in a single batch
+    if HyperParam.get('engine', 'lmfit') == 'batch':
+        Result_last, ErrorObj = RegressionMC_batch(xdata, ydata, MyModel, HyperParam, x0)
+        ErrorObj['sampler'] = sampler
+        return Result_last, ErrorObj
+
+    # global search: the starts evolve by differential evolution
+    if HyperParam.get('engine', 'lmfit') == 'de':
+        Result_last, ErrorObj = RegressionMC_de(xdata, ydata, MyModel, HyperParam, x0)
+        ErrorObj['sampler'] = sampler
+        return Result_last, ErrorObj
+
+    # n-th curve fit (the same routine runs serially or in the pool)
+    fit_n = partial(RegressionMC_fit, xdata, ydata, MyModel, HyperParam)
+
+    # adaptive stopping rules
+    stop_window = HyperParam.get('stop_window')
+    stop_tol = HyperParam.get('stop_tol', 1e-6)
+    stop_Nconv = HyperParam.get('stop_Nconv')
+    stop_ptol = HyperParam.get('stop_ptol', 1e-4)
+    time_budget = HyperParam.get('time_budget')
+    tstart = perf_counter()
+    n_stall = 0
+    optima = []
 
     # find the best curve fit via Monte Carlo
-    for n in range(0, Ns):
-        # n-th curve fit
-        print('Monte Carlo: ' + str(n+1))
-        params = Parameters()
-        #add with tuples:(NAME VALUE        VARY     MIN        MAX    EXPR  BRUTE_STEP)
-        if len(ub) == 2:
-            tau = HyperParam['tau']
-            params.add_many(('tau',      tau,  False,    None,      None),
-                            ('K'  , x0[0, n],   True, lb[0, 0], ub[0, 0]),
-                            ('r'  , x0[1, n],   True, lb[1, 0], ub[1, 0]))
+    with ProcessPoolExecutor(max_workers=Nworkers) if Nworkers > 1 else _SerialPool() as pool:
+        # results come back in the order of the starts, so the
+        # selection below is identical for serial and parallel runs
+        for n, (Result, mse, rmse, rsquare) in enumerate(pool.map(fit_n, x0.T)):
+            print('Monte Carlo: ' + str(n+1))
+            if _TELEMETRY['file'] is not None:
+                telemetry_record('start', n=n + 1, wall=Result.wall_time, nfev=Result.nfev,
+                                 success=Result.success, rmse=rmse, x0=x0[:, n])
+
+            # consecutive starts without a significant improvement
+            n_stall = 0 if rmse < (1 - stop_tol) * ErrorObj['rmse'] else n_stall + 1
+
+            # update the model with small error
+            if rmse < ErrorObj['rmse']:
+                ErrorObj['mse'] = mse
+                ErrorObj['rmse'] = rmse
+                ErrorObj['rsquare'] = rsquare
+                Result_last = Result
+            ErrorObj['Ns_used'] = n + 1
+
+            # starts that converged to the best parameters
+            optima.append([Result.params[name].value for name in Result.var_names])
+            pbest = np.array([Result_last.params[name].value for name in Result_last.var_names])
+            n_conv = np.sum(np.all(np.abs(np.array(optima) - pbest) <= stop_ptol * np.abs(pbest), axis=1))
+
+            if ((stop_window is not None and n_stall >= stop_window) or
+                    (stop_Nconv is not None and n_conv >= stop_Nconv) or
+                    (time_budget is not None and perf_counter() - tstart >= time_budget)):
+                # drop the starts that have not begun yet
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+
+    return Result_last, ErrorObj
+
+
+# HyperParam entries that do not change the result of a fit
+_FIT_CACHE_IGNORED = ('Nworkers', 'cache_dir', 'cache_size')
+
+# version of the store layout, and digest of this module's source code
+# (kernels, engines and BatchLM), computed on first use
+_FIT_CACHE = {'version': 1, 'source': None}
+
+# ModelResult attributes kept in the store
+_FIT_CACHE_ATTRS = ('var_names', 'init_values', 'nfev', 'success', 'message', 'ndata',
+                    'nvarys', 'nfree', 'chisqr', 'redchi', 'aic', 'bic', 'rsquared')
+
+
+def RegressionMC_cache_key(xdata, ydata, MyModel, HyperParam):
+    #  This routine defines the key of a fit in the store of RegressionMC:
+    #  a digest of the training data, the model function (name and source
+    #  code), every HyperParam entry that changes the result (bounds,
+    #  Ns, seed, tau, sampler, engine, ...), the source code of this
+    #  module and the versions of the store, lmfit and NumPy, so that no
+    #  change of the fitting code serves a stale fit.
+    #  Input:
+    #  xdata      - independent parameter data
+    #  ydata      - dependent   parameter data
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters
+    #  Output:
+    #  key - hexadecimal digest, with the suffix of the store entries
+    func = MyModel.func
+    try:
+        source = inspect.getsource(func if inspect.isfunction(func) else type(func))
+    except (OSError, TypeError):
+        source = ''
+    settings = {name: value for name, value in HyperParam.items() if name not in _FIT_CACHE_IGNORED}
+    if _FIT_CACHE['source'] is None:
+        with open(__file__, 'rb') as f:
+            _FIT_CACHE['source'] = hashlib.sha256(f.read()).hexdigest()
+
+    digest = hashlib.sha256()
+    digest.update(str(_FIT_CACHE['version']).encode())
+    digest.update(_FIT_CACHE['source'].encode())
+    digest.update(lmfit.__version__.encode())
+    digest.update(np.__version__.encode())
+    digest.update(np.ascontiguousarray(xdata, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(ydata, dtype=np.float64).tobytes())
+    digest.update(MyModel.name.encode())
+    digest.update(source.encode())
+    digest.update(json.dumps(settings, sort_keys=True, default=_telemetry_json).encode())
+    return digest.hexdigest() + '-fit.json'
+
+
+def RegressionMC_cache_save(cache_dir, key, Result, ErrorObj, cache_size=64 * 2 ** 20):
+    #  This routine stores a fit: the fitted parameters (with their
+    #  standard errors), the covariance, the fit statistics and the error
+    #  object, including AIC and BIC when they are in ErrorObj.
+    #  Input:
+    #  cache_dir  - directory of the store
+    #  key        - entry key, see RegressionMC_cache_key
+    #  Result     - fitting model object
+    #  ErrorObj   - fitting error object
+    #  cache_size - maximum size of the store in bytes
+    record = {attr: getattr(Result, attr, None) for attr in _FIT_CACHE_ATTRS}
+    record['params'] = Result.params.dumps()
+    record['covar'] = Result.covar
+    record['ErrorObj'] = ErrorObj
+    cache_save(cache_dir, key, json.dumps(record, default=_telemetry_json).encode(), cache_size)
+
+
+def RegressionMC_cache_load(cache_dir, key, xdata, ydata, MyModel):
+    #  This routine reads a stored fit back as the usual result object,
+    #  without running the regression.
+    #  Input:
+    #  cache_dir - directory of the store
+    #  key       - entry key, see RegressionMC_cache_key
+    #  xdata     - independent parameter data
+    #  ydata     - dependent   parameter data
+    #  MyModel   - algebraic model structure
+    #  Output:
+    #  (Result, ErrorObj), with ErrorObj['cache'] = 'hit', or None when
+    #  the fit is not in the store. Result carries the fitted and initial
+    #  parameters, best_fit, init_fit, residual and the fit statistics;
+    #  the attributes of the minimizer run itself (Result.result, the
+    #  Jacobian and the iteration history) are not restored
+    data = cache_load(cache_dir, key)
+    if data is None:
+        return None
+    record = json.loads(data.decode())
+
+    params = Parameters().loads(record['params'])
+    Result = ModelResult(MyModel, params, data=np.asarray(ydata, dtype=np.float64),
+                         fcn_kws={'x': xdata})
+    for attr in _FIT_CACHE_ATTRS:
+        setattr(Result, attr, record[attr])
+    Result.covar = None if record['covar'] is None else np.array(record['covar'])
+    Result.best_values = {name: par.value for name, par in params.items()}
+    Result.best_fit = MyModel.eval(params, x=xdata)
+    Result.residual = lmfit_residual_sign() * (Result.best_fit - Result.data)
+    Result.init_params = params.copy()
+    for name, value in Result.init_values.items():
+        if name in Result.init_params:
+            Result.init_params[name].value = value
+    Result.init_fit = MyModel.eval(Result.init_params, x=xdata)
+    Result.wall_time = 0.0
+
+    ErrorObj = record['ErrorObj']
+    ErrorObj['cache'] = 'hit'
+    return Result, ErrorObj
+
+
+def RegressionMC_warm(xdata, ydata, MyModel, HyperParam, best_values=None, rmse=None):
+    #  This routine fits a model warm-started from previous best
+    #  parameters, falling back to the full Monte Carlo search of
+    #  RegressionMC when there are none or the warm-started fit is
+    #  noticeably worse than the previous one.
+    #  Input:
+    #  xdata       - independent parameter data
+    #  ydata       - dependent   parameter data
+    #  MyModel     - algebraic model structure
+    #  HyperParam  - algebraic model parameters, as in RegressionMC
+    #  best_values - previous best parameters (dict, optional)
+    #  rmse        - RMSE of the previous fit (optional)
+    #  Optional HyperParam entries:
+    #  refit_tol   - relative RMSE increase over the previous fit that
+    #                triggers the full Monte Carlo search (default: 0.1)
+    #  Output:
+    #  Result  - fitting model object
+    #  ErrorObj - fitting error object (ErrorObj['warm_start'] tells
+    #             whether the warm-started fit was kept)
+    refit = True
+    if best_values is not None:
+        x0n = np.array([best_values[name] for name in RegressionMC_names(HyperParam)])
+        x0n = np.clip(x0n, HyperParam['lb'][:, 0], HyperParam['ub'][:, 0])
+        Result, mse, rmse_n, rsquare = RegressionMC_fit(xdata, ydata, MyModel, HyperParam, x0n)
+        ErrorObj = {'mse': mse, 'rmse': rmse_n, 'rsquare': rsquare, 'Ns_used': 1, 'warm_start': True}
+        refit = not Result.success or (rmse is not None and
+                                       rmse_n > (1 + HyperParam.get('refit_tol', 0.1)) * rmse)
+
+    if refit:
+        # full Monte Carlo search, kept unless the warm start did better
+        Result_MC, ErrorObj_MC = RegressionMC(xdata, ydata, MyModel, HyperParam)
+        if best_values is None or ErrorObj_MC['rmse'] <= ErrorObj['rmse']:
+            Result, ErrorObj = Result_MC, ErrorObj_MC
+            ErrorObj['warm_start'] = False
+    return Result, ErrorObj
+
+
+def RegressionMC_update(xdata, ydata, MyModel, HyperParam, store):
+    #  This routine refits a model incrementally as new observations
+    #  arrive. The observations are appended to a stored dataset and the
+    #  fit is warm-started from the stored best parameters; the full
+    #  Monte Carlo search of RegressionMC runs only on the first call or
+    #  when the warm-started fit is noticeably worse than the previous one.
+    #  Input:
+    #  xdata      - new independent parameter data (e.g. the latest day);
+    #               stored points with the same x are replaced
+    #  ydata      - new dependent   parameter data
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters, as in RegressionMC
+    #  store      - JSON file holding the dataset and the last fit
+    #  (see RegressionMC_warm for the refit_tol entry of HyperParam)
+    #  Output:
+    #  Result  - fitting model object
+    #  ErrorObj - fitting error object (ErrorObj['warm_start'] tells
+    #             whether the warm-started fit was kept)
+    #  xstore  - whole independent parameter data
+    #  ystore  - whole dependent   parameter data
+    xdata = np.atleast_1d(np.asarray(xdata, dtype=np.float64))
+    ydata = np.atleast_1d(np.asarray(ydata, dtype=np.float64))
+    names = RegressionMC_names(HyperParam)
+
+    state = None
+    if os.path.exists(store):
+        with open(store) as f:
+            state = json.load(f)
+        keep = ~np.isin(state['x'], xdata)
+        xdata = np.concatenate((np.asarray(state['x'])[keep], xdata))
+        ydata = np.concatenate((np.asarray(state['y'])[keep], ydata))
+        order = np.argsort(xdata, kind='stable')
+        xdata, ydata = xdata[order], ydata[order]
+
+    if state is None:
+        Result, ErrorObj = RegressionMC_warm(xdata, ydata, MyModel, HyperParam)
+    else:
+        Result, ErrorObj = RegressionMC_warm(xdata, ydata, MyModel, HyperParam,
+                                             state['best_values'], state['rmse'])
+
+    state = {'x': xdata.tolist(),
+             'y': ydata.tolist(),
+             'best_values': {name: Result.best_values[name] for name in names},
+             'rmse': ErrorObj['rmse']}
+    with open(store + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(store + '.tmp', store)
+
+    return Result, ErrorObj, xdata, ydata
+
+
+def RegressionMC_backtest(time, ydata, MyModel, HyperParam, origins, horizon,
+                          TrainDataStart=None, Nworkers=1, conf=0.95):
+    #  This routine evaluates the forecasts of a model by rolling-origin
+    #  backtesting: the model is refitted with the training data ending at
+    #  every origin and its forecast of the following days is compared
+    #  with the data. The origins are split into contiguous blocks, one
+    #  per worker process, and within a block every fit is warm-started
+    #  from the previous origin (see RegressionMC_warm).
+    #  Input:
+    #  time           - time vector, indexed like ydata
+    #  ydata          - new events per day, indexed by date
+    #  MyModel        - algebraic model structure (lmfit Model)
+    #  HyperParam     - algebraic model parameters, as in RegressionMC
+    #  origins        - training end dates
+    #  horizon        - number of forecast days after every origin
+    #  TrainDataStart - training start date (default: first date)
+    #  Nworkers       - number of worker processes
+    #  conf           - confidence level of the predband interval
+    #  Output:
+    #  summary - table of the forecast RMSE, mean absolute error and
+    #            interval coverage by horizon (days after the origin)
+    #  records - table of the forecasts, one row per origin and horizon
+    HyperParam = dict(HyperParam, Nworkers=1)
+    blocks = [block for block in np.array_split(np.asarray(origins), Nworkers) if block.size > 0]
+    backtest = partial(_RegressionMC_backtest_block, time, ydata, MyModel, HyperParam,
+                       horizon=horizon, TrainDataStart=TrainDataStart, conf=conf)
+    with ProcessPoolExecutor(max_workers=Nworkers) if Nworkers > 1 else _SerialPool() as pool:
+        records = pd.concat(list(pool.map(backtest, blocks)), ignore_index=True)
+
+    error = records['ydata'] - records['ypred']
+    summary = pd.DataFrame({'N': error.groupby(records['horizon']).size(),
+                            'RMSE': np.sqrt((error ** 2).groupby(records['horizon']).mean()),
+                            'MAE': error.abs().groupby(records['horizon']).mean(),
+                            'coverage': records['inside'].groupby(records['horizon']).mean()})
+    return summary.reset_index(), records
+
+
+def _RegressionMC_backtest_block(time, ydata, MyModel, HyperParam, block, horizon,
+                                 TrainDataStart=None, conf=0.95):
+    #  This routine runs the origins of one contiguous block of
+    #  RegressionMC_backtest, warm-starting every fit from the previous one.
+    records = []
+    best_values, rmse = None, None
+    for origin in block:
+        end = ydata.index.get_loc(origin) + 1
+        start = 0 if TrainDataStart is None else ydata.index.get_loc(TrainDataStart)
+        time_train = np.asarray(time.iloc[start:end], dtype=np.float64)
+        Data_train = np.asarray(ydata.iloc[start:end], dtype=np.float64)
+        time_fore = np.asarray(time.iloc[end:end + horizon], dtype=np.float64)
+        Data_fore = np.asarray(ydata.iloc[end:end + horizon], dtype=np.float64)
+
+        Result, ErrorObj = RegressionMC_warm(time_train, Data_train, MyModel, HyperParam, best_values, rmse)
+        best_values, rmse = Result.best_values, ErrorObj['rmse']
+
+        p = np.array([best_values[name] for name in MyModel.param_names])
+        ypred = MyModel.func(time_fore, *p)
+        lower, upper = predband(time_fore, time_train, Data_train, p, MyModel.func, conf=conf)
+        records.append(pd.DataFrame({'origin': origin,
+                                     'horizon': np.arange(1, len(time_fore) + 1),
+                                     'ydata': Data_fore,
+                                     'ypred': ypred,
+                                     'lower': lower,
+                                     'upper': upper,
+                                     'inside': (lower <= Data_fore) & (Data_fore <= upper),
+                                     'warm_start': ErrorObj['warm_start']}))
+    return pd.concat(records, ignore_index=True)
+
+
+def RegressionMC_panel(time, Data, MyModel, HyperParam, engine='batch', Nworkers=1, chunk=64):
+    #  This routine fits the same model to the series of many regions.
+    #  Input:
+    #  time       - time vector (T)
+    #  Data       - new events per day (regions x T), e.g. from load_panel
+    #  MyModel    - algebraic model structure (lmfit Model)
+    #  HyperParam - algebraic model parameters, as in RegressionMC; lb and
+    #               ub may hold one column of bounds per region (p x R)
+    #               and tau one value per region (R)
+    #  engine     - 'batch' (default) fits the Monte Carlo starts of
+    #               chunk regions at once with BatchLM; 'lmfit' runs
+    #               RegressionMC for every region in Nworkers processes
+    #  Nworkers   - number of worker processes of the 'lmfit' engine
+    #  chunk      - number of regions per BatchLM call of the 'batch'
+    #               engine, which bounds its memory use
+    #  Output:
+    #  table - fitted model parameters, mse, rmse and rsquare of every
+    #          region
+    Data = pd.DataFrame(Data)
+    time = np.asarray(time, dtype=np.float64)
+    Y = Data.to_numpy(dtype=np.float64)
+    R = Y.shape[0]
+    names = MyModel.param_names
+    free = RegressionMC_names(HyperParam)
+    lb = np.broadcast_to(HyperParam['lb'], (len(free), R))
+    ub = np.broadcast_to(HyperParam['ub'], (len(free), R))
+    tau = np.broadcast_to(HyperParam.get('tau', 0), (R,))
+
+    if engine == 'lmfit':
+        HyperParams = [dict(HyperParam, lb=lb[:, [n]], ub=ub[:, [n]], tau=tau[n], Nworkers=1)
+                       for n in range(0, R)]
+        with ProcessPoolExecutor(max_workers=Nworkers) if Nworkers > 1 else _SerialPool() as pool:
+            fits = list(pool.map(_RegressionMC_panel_region, [time] * R, Y, [MyModel] * R, HyperParams))
+        table = pd.DataFrame([dict(Result_values, **ErrorObj) for Result_values, ErrorObj in fits],
+                             index=Data.index)
+        return table[names + ['mse', 'rmse', 'rsquare']]
+
+    kernel = _BATCH_KERNELS.get(MyModel.func, getattr(MyModel.func, 'batch', None))
+    if kernel is None:
+        raise ValueError('no batch kernel for model ' + MyModel.func.__name__)
+    ifree = np.array([names.index(name) for name in free])
+
+    # initial guesses of all regions from one set of unit-box draws
+    Ns = HyperParam['Ns']
+    u = RegressionMC_x0(np.zeros((len(free), 1)), np.ones((len(free), 1)), Ns,
+                        HyperParam.get('seed'), HyperParam.get('sampler', 'legacy'))
+    log = np.array([name in HyperParam.get('log_params', []) for name in free])
+
+    P = np.zeros((R, len(names)))
+    for i in range(0, R, chunk):
+        lbc, ubc = lb[:, i:i + chunk].T, ub[:, i:i + chunk].T
+        x0 = lbc[:, :, None] + (ubc - lbc)[:, :, None] * u[None, :, :]
+        x0[:, log] = lbc[:, log, None] * (ubc[:, log] / lbc[:, log])[:, :, None] ** u[None, log, :]
+
+        # Ns starts per region, with the region's data and bounds
+        P0 = np.zeros((x0.shape[0] * Ns, len(names)))
+        if 'tau' in names and 'tau' not in free:
+            P0[:, names.index('tau')] = np.repeat(tau[i:i + chunk], Ns)
+        P0[:, ifree] = x0.transpose(0, 2, 1).reshape(-1, len(free))
+        Pc, cost = BatchLM(time, np.repeat(Y[i:i + chunk], Ns, axis=0), P0, ifree,
+                           np.repeat(lbc, Ns, axis=0), np.repeat(ubc, Ns, axis=0), kernel)
+
+        # first start with the smallest error of every region
+        nbest = np.argmin(cost.reshape(-1, Ns), axis=1)
+        P[i:i + chunk] = Pc.reshape(-1, Ns, len(names))[np.arange(len(nbest)), nbest]
+
+    yhat, J = kernel(time, P, jac=False)
+    mse = np.mean((Y - yhat) ** 2, axis=1)
+    table = pd.DataFrame(P, index=Data.index, columns=names)
+    table['mse'] = mse
+    table['rmse'] = np.sqrt(mse)
+    table['rsquare'] = 1 - mse / np.var(Y, axis=1)
+    return table
+
+
+def _RegressionMC_panel_region(time, ydata, MyModel, HyperParam):
+    #  This routine fits one region of RegressionMC_panel ('lmfit' engine).
+    Result, ErrorObj = RegressionMC(time, ydata, MyModel, HyperParam)
+    return Result.best_values, {key: ErrorObj[key] for key in ('mse', 'rmse', 'rsquare')}
+
+
+def RegressionMC_x0(lb, ub, Ns, seed=None, sampler='legacy', log=None):
+    #  This routine draws the ensemble of initial guesses for RegressionMC.
+    #  Without a seed the global NumPy generator is used, as before. With
+    #  a seed, every start draws from its own stream spawned from the
+    #  seed, so the n-th guess does not depend on how the starts are
+    #  distributed among workers.
+    #  Input:
+    #  lb      - lower bounds of the parameters (p x 1)
+    #  ub      - upper bounds of the parameters (p x 1)
+    #  Ns      - number of initial guesses
+    #  seed    - seed of the random streams (optional)
+    #  sampler - 'legacy'  : one uniform number per start, shared by all
+    #                        parameters (the original sampler, default)
+    #            'uniform' : independent uniform coordinates
+    #            'sobol'   : scrambled Sobol sequence
+    #            'halton'  : scrambled Halton sequence
+    #            'lhs'     : Latin hypercube
+    #  log     - mask of the parameters sampled log-uniformly (p), e.g.
+    #            growth rates spanning orders of magnitude (optional)
+    #  Output:
+    #  x0 - initial guesses (p x Ns)
+    p = lb.shape[0]
+    if sampler in ('legacy', 'uniform'):
+        # coordinates drawn per start (one shared number for 'legacy')
+        d = 1 if sampler == 'legacy' else p
+        if seed is None:
+            u = np.random.rand(d, Ns)
+        else:
+            streams = np.random.SeedSequence(seed).spawn(Ns)
+            u = np.array([np.random.default_rng(s).random(d) for s in streams]).T
+    elif sampler in ('sobol', 'halton', 'lhs'):
+        # space-filling designs, scrambled by the seed
+        if sampler == 'sobol':
+            engine = qmc.Sobol(p, scramble=True, seed=seed)
+        elif sampler == 'halton':
+            engine = qmc.Halton(p, scramble=True, seed=seed)
+        else:
+            engine = qmc.LatinHypercube(p, seed=seed)
+        with warnings.catch_warnings():
+            # Sobol points are best balanced for Ns a power of 2
+            warnings.simplefilter('ignore', UserWarning)
+            u = engine.random(Ns).T
+    else:
+        raise ValueError('unknown sampler ' + str(sampler))
+
+    u = np.broadcast_to(u, (p, Ns))
+    x0 = lb + (ub - lb) * u
+    if log is not None and np.any(log):
+        log = np.asarray(log, dtype=bool)
+        x0[log] = lb[log] * (ub[log] / lb[log]) ** u[log]
+    return x0
+
+
+def RegressionMC_names(HyperParam):
+    #  This routine lists the names of the free model parameters.
+    #  Input:
+    #  HyperParam - algebraic model parameters
+    #  Output:
+    #  list of names, in the order of the rows of lb and ub
+    return ['K', 'r'] if len(HyperParam['ub']) == 2 else list(HyperParam['p'])
+
+
+def RegressionMC_params(HyperParam, x0n):
+    #  This routine builds the lmfit parameters of a single Monte Carlo start.
+    #  Input:
+    #  HyperParam - algebraic model parameters
+    #  x0n        - initial guess of the free parameters
+    #  Output:
+    #  params - lmfit parameters object
+    ub = HyperParam['ub']
+    lb = HyperParam['lb']
+    params = Parameters()
+    #add with tuples:(NAME VALUE        VARY     MIN        MAX    EXPR  BRUTE_STEP)
+    if len(ub) == 2:
+        tau = HyperParam['tau']
+        params.add_many(('tau',      tau,  False,    None,      None),
+                        ('K'  ,   x0n[0],   True, lb[0, 0], ub[0, 0]),
+                        ('r'  ,   x0n[1],   True, lb[1, 0], ub[1, 0]))
+    else:
+        pp = HyperParam['p']
+        for i in range(0, len(pp)):
+            params.add_many((pp[i], x0n[i], True, lb[i, 0], ub[i, 0]))
+    return params
+
+
+def RegressionMC_fit(xdata, ydata, MyModel, HyperParam, x0n):
+    #  This routine runs the regression of a single Monte Carlo start.
+    #  Input:
+    #  xdata      - independent parameter data
+    #  ydata      - dependent   parameter data
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters
+    #  x0n        - initial guess of the free parameters
+    #  Output:
+    #  Result  - fitting model object (Result.wall_time is the fit time)
+    #  mse     - mean squared error
+    #  rmse    - root mean squared error
+    #  rsquare - coefficient of determination
+    params = RegressionMC_params(HyperParam, x0n)
+
+    # analytic Jacobian, when the model has one
+    fit_kws = None
+    jacfun = _JACOBIANS.get(MyModel.func, getattr(MyModel.func, 'jac', None))
+    if HyperParam.get('jac', True) and jacfun is not None:
+        fit_kws = {'Dfun': partial(lmfit_jacobian, jacfun, MyModel.param_names)}
+
+    tstart = perf_counter()
+    Result = MyModel.fit(ydata, params, x=xdata, fit_kws=fit_kws)
+    Result.wall_time = perf_counter() - tstart
+    yhat = Result.best_fit
+    mse = metrics.mean_squared_error(ydata, yhat)
+    rmse = np.sqrt(mse)
+    rsquare = metrics.r2_score(ydata, yhat)
+    return Result, mse, rmse, rsquare
+
+
+class _SerialPool:
+    #  Stand-in for a process pool that runs the tasks lazily in the
+    #  calling process, so RegressionMC and graph_render have a single
+    #  code path.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, *iterables, chunksize=1):
+        return map(fn, *iterables)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def RegressionMC_batch(xdata, ydata, MyModel, HyperParam, x0):
+    #  This routine is the native engine of RegressionMC. All the Monte
+    #  Carlo starts are fitted at once by a batched Levenberg-Marquardt
+    #  algorithm (see BatchLM), and the best start is handed over to
+    #  lmfit, which converges at once and returns the usual result object.
+    #  Input:
+    #  xdata      - independent parameter data
+    #  ydata      - dependent   parameter data
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters
+    #  x0         - initial guesses (p x Ns)
+    #  Output:
+    #  Result_last - fitting model object
+    #  ErrorObj - fitting error object
+    kernel = _BATCH_KERNELS.get(MyModel.func, getattr(MyModel.func, 'batch', None))
+    if kernel is None:
+        raise ValueError('no batch kernel for model ' + MyModel.func.__name__)
+
+    # free parameters and their position among the model arguments
+    names = MyModel.param_names
+    free = RegressionMC_names(HyperParam)
+    ifree = np.array([names.index(name) for name in free])
+
+    # full parameter matrix, including the fixed tau of single-wave fits
+    P0 = np.zeros((x0.shape[1], len(names)))
+    if 'tau' in names and 'tau' not in free:
+        P0[:, names.index('tau')] = HyperParam['tau']
+    P0[:, ifree] = x0.T
+
+    xdata = np.asarray(xdata, dtype=np.float64)
+    ydata = np.asarray(ydata, dtype=np.float64)
+    fused = RegressionMC_fused(MyModel, HyperParam)
+    P, cost = BatchLM(xdata, ydata, P0, ifree,
+                      HyperParam['lb'][:, 0], HyperParam['ub'][:, 0], kernel, fused=fused)
+    if _TELEMETRY['file'] is not None:
+        for n in range(0, P.shape[0]):
+            telemetry_record('start', n=n + 1, engine='batch', rmse=np.sqrt(cost[n] / xdata.size), x0=x0[:, n])
+
+    # first start with the smallest error, as in the serial selection
+    nbest = np.argmin(cost)
+    Result_last, mse, rmse, rsquare = RegressionMC_fit(xdata, ydata, MyModel, HyperParam, P[nbest, ifree])
+
+    ErrorObj = {}
+    ErrorObj['mse'] = mse
+    ErrorObj['rmse'] = rmse
+    ErrorObj['rsquare'] = rsquare
+    ErrorObj['Ns_used'] = x0.shape[1]
+    ErrorObj['backend'] = 'numpy' if fused is None else 'numba'
+    return Result_last, ErrorObj
+
+
+def RegressionMC_de(xdata, ydata, MyModel, HyperParam, x0):
+    #  This routine is the global engine of RegressionMC. The Monte Carlo
+    #  starts are the initial population of a differential evolution
+    #  search inside the lb/ub box: every generation, the sums of squares
+    #  of the whole trial population are evaluated in one call of the
+    #  batch kernel. The best members are then polished together by
+    #  BatchLM, and the best of them is handed over to lmfit, as in
+    #  RegressionMC_batch.
+    #  Input:
+    #  xdata      - independent parameter data
+    #  ydata      - dependent   parameter data
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters
+    #  x0         - initial population (p x Ns), Ns of about 5 to 10
+    #               times the number of parameters
+    #  Optional HyperParam entries:
+    #  de_strategy - mutation: 'pbest1' (default, from the target towards
+    #                one of the best 10% members), 'best1' or 'rand1'
+    #  de_F        - range of the dithered mutation factor (default: [0.5, 1])
+    #  de_CR       - crossover probability (default: 0.9)
+    #  de_maxgen   - maximum number of generations (default: 1000)
+    #  de_tol      - stop when std(cost) <= de_tol * mean(cost) in the
+    #                population (default: 0.01)
+    #  de_polish   - number of best members polished (default: 5)
+    #  Output:
+    #  Result_last - fitting model object
+    #  ErrorObj - fitting error object (ErrorObj['generations'] and
+    #             ErrorObj['nfev'], the number of model evaluations of
+    #             the search)
+    kernel = _BATCH_KERNELS.get(MyModel.func, getattr(MyModel.func, 'batch', None))
+    if kernel is None:
+        raise ValueError('no batch kernel for model ' + MyModel.func.__name__)
+    strategy = HyperParam.get('de_strategy', 'pbest1')
+    if strategy not in ('pbest1', 'best1', 'rand1'):
+        raise ValueError('unknown strategy ' + str(strategy))
+    F_lb, F_ub = HyperParam.get('de_F', [0.5, 1.0])
+    CR = HyperParam.get('de_CR', 0.9)
+    maxgen = HyperParam.get('de_maxgen', 1000)
+    tol = HyperParam.get('de_tol', 0.01)
+
+    # free parameters and their position among the model arguments
+    names = MyModel.param_names
+    free = RegressionMC_names(HyperParam)
+    ifree = np.array([names.index(name) for name in free])
+    lb, ub = HyperParam['lb'][:, 0], HyperParam['ub'][:, 0]
+
+    xdata = np.asarray(xdata, dtype=np.float64)
+    ydata = np.asarray(ydata, dtype=np.float64)
+    fused = RegressionMC_fused(MyModel, HyperParam)
+
+    # full parameter matrix, including the fixed tau of single-wave fits
+    P = np.zeros((x0.shape[1], len(names)))
+    if 'tau' in names and 'tau' not in free:
+        P[:, names.index('tau')] = HyperParam['tau']
+    P[:, ifree] = x0.T
+    NP, d = P.shape[0], len(ifree)
+    if NP < 4:
+        raise ValueError('differential evolution needs Ns >= 4')
+    if maxgen < 1:
+        raise ValueError('differential evolution needs de_maxgen >= 1')
+
+    def sumsq(P):
+        if fused is not None:
+            res, cost, J = fused(xdata, P, ydata, jac=False)
+            return cost
+        f, J = kernel(xdata, P, jac=False)
+        return np.sum((f - ydata) ** 2, axis=1)
+
+    tstart = perf_counter()
+    rng = np.random.default_rng(HyperParam.get('seed'))
+    cost = sumsq(P)
+    rows = np.arange(NP)
+    for generation in range(1, maxgen + 1):
+        # three distinct members other than the target, for every target
+        R = rng.random((NP, NP))
+        R[rows, rows] = np.inf
+        r = np.argpartition(R, 3, axis=1)[:, :3]
+        X = P[:, ifree]
+        F = rng.uniform(F_lb, F_ub, (NP, 1))
+        if strategy == 'pbest1':
+            # towards one of the best members (top 10%), from the target
+            pbest = np.argsort(cost)[rng.integers(0, max(2, NP // 10), NP)]
+            mutant = X + F * (X[pbest] - X) + F * (X[r[:, 0]] - X[r[:, 1]])
         else:
-            pp = HyperParam['p']
-            for i in range(0, len(pp)):
-                params.add_many((pp[i], x0[i, n], True, lb[i, 0], ub[i, 0]))
-
-        Result = MyModel.fit(ydata, params, x=xdata)
-        yhat = Result.best_fit
-        mse = metrics.mean_squared_error(ydata, yhat)
-        rmse = np.sqrt(mse)
-        rsquare = metrics.r2_score(ydata, yhat)
-
-        # update the model with small error
-        if rmse < ErrorObj['rmse']:
-            ErrorObj['mse'] = mse
-            ErrorObj['rmse'] = rmse
-            ErrorObj['rsquare'] = rsquare
-            Result_last = Result
+            base = X[np.argmin(cost)] if strategy == 'best1' else X[r[:, 2]]
+            mutant = base + F * (X[r[:, 0]] - X[r[:, 1]])
+
+        # binomial crossover, with at least one coordinate of the mutant
+        cross = rng.random((NP, d)) < CR
+        cross[rows, rng.integers(0, d, NP)] = True
+        trial = np.where(cross, mutant, X)
+
+        # coordinates out of the box go between the target and the bound
+        u = rng.random((NP, d))
+        trial = np.where(trial < lb, lb + u * (X - lb), trial)
+        trial = np.where(trial > ub, ub - u * (ub - X), trial)
+
+        # one batch evaluation of the trial population and selection
+        Ptrial = P.copy()
+        Ptrial[:, ifree] = trial
+        cost_trial = sumsq(Ptrial)
+        better = cost_trial <= cost
+        P[better], cost[better] = Ptrial[better], cost_trial[better]
+
+        if np.std(cost) <= tol * np.abs(np.mean(cost)):
+            break
+    nfev = NP * (generation + 1)
 
+    # local polish of the best members
+    best = np.argsort(cost)[:HyperParam.get('de_polish', 5)]
+    Pp, cost_p = BatchLM(xdata, ydata, P[best], ifree, lb, ub, kernel, fused=fused)
+    if _TELEMETRY['file'] is not None:
+        telemetry_record('de', wall=perf_counter() - tstart, generations=generation, nfev=nfev,
+                         rmse=np.sqrt(cost.min() / xdata.size), rmse_polish=np.sqrt(cost_p.min() / xdata.size))
+    nbest = np.argmin(cost_p)
+    Result_last, mse, rmse, rsquare = RegressionMC_fit(xdata, ydata, MyModel, HyperParam, Pp[nbest, ifree])
+
+    ErrorObj = {}
+    ErrorObj['mse'] = mse
+    ErrorObj['rmse'] = rmse
+    ErrorObj['rsquare'] = rsquare
+    ErrorObj['Ns_used'] = NP
+    ErrorObj['generations'] = generation
+    ErrorObj['nfev'] = nfev
+    ErrorObj['backend'] = 'numpy' if fused is None else 'numba'
     return Result_last, ErrorObj
 
 
+def RegressionMC_fused(MyModel, HyperParam):
+    #  This routine selects the fused kernel of the 'numba' backend, or
+    #  None for the NumPy batch kernels.
+    #  Input:
+    #  MyModel    - algebraic model structure
+    #  HyperParam - algebraic model parameters
+    #  Output:
+    #  fused kernel, or None
+    if HyperParam.get('backend', 'numpy') != 'numba' or _logistic_waves_jit is None:
+        return None
+    return _FUSED_KERNELS.get(MyModel.func, getattr(MyModel.func, 'fused', None))
+
+
+def BatchLM(x, Y, P0, ifree, lb, ub, kernel, maxiter=500, ftol=1.5e-8, xtol=1.5e-8, fused=None):
+    #  This routine runs damped Gauss-Newton (Levenberg-Marquardt) steps
+    #  on a batch of least-squares problems at once. Steps are clipped to
+    #  the bounds, and every problem leaves the batch when it converges.
+    #  Input:
+    #  x       - independent variable (T)
+    #  Y       - data (T) or one dataset per problem (B x T)
+    #  P0      - initial model parameters (B x p)
+    #  ifree   - indices of the free parameters in P0 (m)
+    #  lb      - lower bounds of the free parameters (m), or one row of
+    #            bounds per problem (B x m)
+    #  ub      - upper bounds of the free parameters (m or B x m)
+    #  kernel  - batch model, kernel(x, P, jac) -> f (B x T), J (B x T x p)
+    #  maxiter - maximum number of iterations
+    #  ftol    - relative tolerance on the sum of squares
+    #  xtol    - relative tolerance on the parameters
+    #  fused   - fused model, fused(x, P, Y, jac) -> residuals (B x T),
+    #            sums of squares (B), J (B x T x p), used instead of kernel
+    #            (optional)
+    #  Output:
+    #  P    - fitted model parameters (B x p)
+    #  cost - sums of squared residuals (B)
+    P = np.array(P0, dtype=np.float64)
+    P[:, ifree] = np.clip(P[:, ifree], lb, ub)
+    Y = np.broadcast_to(Y, (P.shape[0], len(x)))
+    lb = np.broadcast_to(lb, (P.shape[0], len(ifree)))
+    ub = np.broadcast_to(ub, (P.shape[0], len(ifree)))
+
+    def residuals(P, Y):
+        if fused is not None:
+            return fused(x, P, Y)
+        f, J = kernel(x, P)
+        res = f - Y
+        return res, np.sum(res ** 2, axis=1), J
+
+    res, cost, J = residuals(P, Y)
+    J = J[:, :, ifree]
+    lam = np.full(P.shape[0], 1e-3)
+
+    # problems still being iterated
+    active = np.arange(P.shape[0])
+    for it in range(0, maxiter):
+        if active.size == 0:
+            break
+        Ja, ra = J[active], res[active]
+        JT = Ja.transpose(0, 2, 1)
+        A = JT @ Ja
+        g = (JT @ ra[:, :, None])[:, :, 0]
+
+        # parameters held at a bound by the gradient do not move
+        Pa = P[active][:, ifree]
+        lba, uba = lb[active], ub[active]
+        held = ((Pa <= lba) & (g > 0)) | ((Pa >= uba) & (g < 0))
+        g[held] = 0
+        A[held[:, :, None] | held[:, None, :]] = 0
+        A[held[:, :, None] & np.eye(len(ifree), dtype=bool)] = 1
+        D = np.einsum('bpp->bp', A) + 1e-12
+        step = -np.linalg.solve(A + (lam[active, None] * D)[:, :, None] * np.eye(len(ifree)),
+                                g[:, :, None])[:, :, 0]
+
+        Pt = P[active].copy()
+        Pt[:, ifree] = np.clip(Pt[:, ifree] + step, lba, uba)
+        rt, ct, Jt = residuals(Pt, Y[active])
+
+        # accept the steps that reduce the sum of squares
+        ok = ct < cost[active]
+        dcost = cost[active] - ct
+        dP = np.abs(Pt[:, ifree] - P[active][:, ifree])
+        iok = active[ok]
+        P[iok], res[iok], J[iok] = Pt[ok], rt[ok], Jt[ok][:, :, ifree]
+        lam[iok] = np.maximum(lam[iok] / 10, 1e-12)
+        lam[active[~ok]] *= 10
+
+        small_cost = ok & (dcost <= ftol * ct)
+        small_step = ok & np.all(dP <= xtol * (np.abs(Pt[:, ifree]) + xtol), axis=1)
+        stalled = lam[active] > 1e12
+        cost[iok] = ct[ok]
+        active = active[~(small_cost | small_step | stalled)]
+
+    return P, cost
+
+
 def predband(x, xd, yd, p, func, conf=0.95):
     from scipy import stats
     x, xd, yd = np.array(x), np.array(xd), np.array(yd)
@@ -150,6 +1629,406 @@ def predband(x, xd, yd, p, func, conf=0.95):
     return lpb, upb
 
 
+def bootband(x, xd, yd, p, func, conf=0.95, B=1000, method='residual', update='linear',
+             ifree=None, lb=None, ub=None, seed=None, chunk=256):
+    #  This routine computes bootstrap prediction bands of a fitted model,
+    #  an alternative to predband that accounts for the uncertainty of
+    #  the nonlinear model parameters.
+    #  Input:
+    #  x      - prediction points
+    #  xd     - independent parameter data of the fit
+    #  yd     - dependent   parameter data of the fit
+    #  p      - fitted model parameters, in the order of the arguments
+    #           of func
+    #  func   - model function
+    #  conf   - confidence level, or a list of levels
+    #  B      - number of bootstrap datasets
+    #  method - 'residual'   : resampled residuals added to the fit
+    #           'parametric' : normal errors with the residual variance
+    #  update - 'linear' : parameters updated by one Gauss-Newton step from
+    #                      the fit (needs the model Jacobian)
+    #           'refit'  : every dataset refitted by BatchLM (needs the
+    #                      batch kernel)
+    #  ifree  - indices of the parameters estimated from the data
+    #           (default: all)
+    #  lb, ub - bounds of those parameters for 'refit' (default: none)
+    #  seed   - seed of the random generator
+    #  chunk  - number of datasets refitted, or prediction points
+    #           evaluated, at once; bounds the memory use
+    #  Output:
+    #  lpb, upb - lower and upper band (T), or (levels x T) for a list of
+    #             confidence levels
+    x, xd, yd = np.asarray(x, dtype=np.float64), np.asarray(xd, dtype=np.float64), np.asarray(yd, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    ifree = np.arange(len(p)) if ifree is None else np.asarray(ifree)
+    N = xd.size  # data sample size
+    var_n = len(ifree)  # number of estimated parameters
+
+    # residuals rescaled for the degrees of freedom
+    yfit = func(xd, *p)
+    res = yd - yfit
+    res = (res - res.mean()) * np.sqrt(N / (N - var_n))
+    se = np.sqrt(np.sum(res ** 2) / N)
+
+    def noise(shape):
+        if method == 'residual':
+            return res[rng.integers(0, N, size=shape)]
+        return rng.normal(0, se, size=shape)
+
+    # bootstrap datasets and their parameters (B x p)
+    P = np.tile(p, (B, 1))
+    if update == 'linear':
+        jacfun = _JACOBIANS.get(func, getattr(func, 'jac', None))
+        if jacfun is None:
+            raise ValueError('no Jacobian for model ' + func.__name__)
+        Jd = jacfun(xd, *p)[:, ifree]
+        # least-squares update of the parameters for every dataset
+        P[:, ifree] += noise((B, N)) @ np.linalg.pinv(Jd).T
+    elif update == 'refit':
+        kernel = _BATCH_KERNELS.get(func, getattr(func, 'batch', None))
+        if kernel is None:
+            raise ValueError('no batch kernel for model ' + func.__name__)
+        lb = np.full(len(ifree), -np.inf) if lb is None else np.ravel(lb)
+        ub = np.full(len(ifree), np.inf) if ub is None else np.ravel(ub)
+        for i in range(0, B, chunk):
+            n = min(chunk, B - i)
+            P[i:i + n], cost = BatchLM(xd, yfit + noise((n, N)), P[i:i + n], ifree, lb, ub, kernel)
+    else:
+        raise ValueError('unknown bootstrap update ' + str(update))
+
+    # quantiles of the predictions, a chunk of prediction points at a time
+    levels = np.atleast_1d(conf)
+    alpha = 1.0 - levels  # significance
+    q = np.concatenate((alpha / 2, 1 - alpha / 2))
+    band = np.empty((len(q), x.size))
+    if update == 'linear':
+        J = jacfun(x, *p)[:, ifree]
+        dP = P[:, ifree] - p[ifree]
+    for i in range(0, x.size, chunk):
+        xc = x[i:i + chunk]
+        if update == 'linear':
+            yp = func(xc, *p) + dP @ J[i:i + chunk].T
+        else:
+            yp, Jc = kernel(xc, P, jac=False)
+        band[:, i:i + chunk] = np.quantile(yp + noise(yp.shape), q, axis=0)
+
+    lpb, upb = band[:len(levels)], band[len(levels):]
+    if np.ndim(conf) == 0:
+        return lpb[0], upb[0]
+    return lpb, upb
+
+
+def deltaband_setup(Result):
+    #  This routine prepares the delta-method bands of a fitted model: the
+    #  parameter covariance is factorized once per fit, so deltaband can
+    #  evaluate any grid without refitting or recomputing residuals.
+    #  Input:
+    #  Result - lmfit fitting model object (e.g. from RegressionMC), with
+    #           the parameter covariance
+    #  Output:
+    #  BandObj - dict with the model function, its Jacobian, the fitted
+    #            parameters, the factor L of the covariance (L L' = covar),
+    #            the residual variance and the degrees of freedom
+    if Result.covar is None:
+        raise ValueError('the fit has no parameter covariance')
+    func = Result.model.func
+    names = Result.model.param_names
+    jacfun = _JACOBIANS.get(func, getattr(func, 'jac', None))
+    if jacfun is None:
+        raise ValueError('no Jacobian for model ' + func.__name__)
+
+    covar = np.asarray(Result.covar, dtype=np.float64)
+    try:
+        L = np.linalg.cholesky(covar)
+    except np.linalg.LinAlgError:
+        # semi-definite covariance: factor from its eigendecomposition
+        w, V = np.linalg.eigh(covar)
+        L = V * np.sqrt(np.clip(w, 0, None))
+
+    BandObj = {}
+    BandObj['func'] = func
+    BandObj['jac'] = jacfun
+    BandObj['p'] = np.array([Result.best_values[name] for name in names])
+    BandObj['ifree'] = np.array([names.index(name) for name in Result.var_names])
+    BandObj['L'] = L
+    BandObj['redchi'] = Result.redchi
+    BandObj['dof'] = Result.nfree
+    return BandObj
+
+
+def deltaband(x, BandObj, conf=0.95, pred=True, chunk=4096):
+    #  This routine evaluates delta-method bands of a fitted model,
+    #  var(f(x)) = J(x) covar J(x)', on a grid of any density.
+    #  Input:
+    #  x       - prediction points
+    #  BandObj - band setup from deltaband_setup
+    #  conf    - confidence level, or a list of levels
+    #  pred    - True for prediction bands (model and observation
+    #            uncertainty), False for confidence bands of the model
+    #  chunk   - number of prediction points evaluated at once
+    #  Output:
+    #  lpb, upb - lower and upper band (T), or (levels x T) for a list of
+    #             confidence levels
+    from scipy import stats
+    x = np.asarray(x, dtype=np.float64)
+    p = BandObj['p']
+    yp = BandObj['func'](x, *p)
+    var = np.empty(x.size)
+    for i in range(0, x.size, chunk):
+        J = BandObj['jac'](x[i:i + chunk], *p)[:, BandObj['ifree']]
+        var[i:i + chunk] = np.sum((J @ BandObj['L']) ** 2, axis=1)
+    if pred:
+        var += BandObj['redchi']
+
+    # Student's t quantiles of all levels at once
+    alpha = 1.0 - np.atleast_1d(conf)  # significance
+    q = stats.t.ppf(1.0 - alpha / 2.0, BandObj['dof'])
+    dy = q[:, None] * np.sqrt(var)[None, :]
+    lpb, upb = yp - dy, yp + dy
+    if np.ndim(conf) == 0:
+        return lpb[0], upb[0]
+    return lpb, upb
+
+
+def RegressionMC_mcmc(xdata, ydata, MyModel, HyperParam, p0=None):
+    #  This routine calibrates a model in a Bayesian way: the posterior
+    #  of the free parameters is sampled by an affine-invariant ensemble
+    #  sampler (stretch move, see EnsembleMCMC), whose walkers are all
+    #  evaluated in one call of the batch kernel of the model. The priors
+    #  are uniform on the RegressionMC bounds (log-uniform for log_params)
+    #  and the observations are counts.
+    #  Input:
+    #  xdata      - independent parameter data
+    #  ydata      - dependent   parameter data (counts)
+    #  MyModel    - algebraic model structure, with a batch kernel
+    #  HyperParam - algebraic model parameters, as in RegressionMC
+    #  p0         - best values of a previous fit (dict, optional); the
+    #               walkers start in a small ball around them, otherwise
+    #               they are drawn over the bounds
+    #  Optional HyperParam entries:
+    #  likelihood - 'poisson' (default) or 'negbin'; the negative binomial
+    #               size is sampled as an extra parameter, 'dispersion'
+    #  dispersion - bounds of the negative binomial size (default:
+    #               [0.1, 1000], log-uniform prior)
+    #  Nwalkers   - walkers per ensemble, even (default: 4 x parameters)
+    #  Nsteps     - steps per walker (default: 2000)
+    #  burn       - initial steps discarded (default: Nsteps / 2)
+    #  thin       - keep one step in thin (default: 1)
+    #  a          - scale of the stretch move (default: 2)
+    #  Nchains    - independent ensembles, merged in the output (default: 1)
+    #  Nworkers   - number of worker processes of the ensembles (default: 1)
+    #  seed       - seed of the random streams (default: None)
+    #  Output:
+    #  MCMCObj - dict with the parameter names, the posterior samples
+    #            (N x d) and their log-posterior, the posterior mean,
+    #            median and maximum, the acceptance fractions, and the
+    #            entries mcmcband needs
+    kernel = _BATCH_KERNELS.get(MyModel.func, getattr(MyModel.func, 'batch', None))
+    if kernel is None:
+        raise ValueError('no batch kernel for model ' + MyModel.func.__name__)
+    likelihood = HyperParam.get('likelihood', 'poisson')
+    if likelihood not in ('poisson', 'negbin'):
+        raise ValueError('unknown likelihood ' + str(likelihood))
+
+    xdata = np.asarray(xdata, dtype=np.float64)
+    ydata = np.asarray(ydata, dtype=np.float64)
+    if np.any(ydata < 0):
+        raise ValueError('the likelihoods need non-negative counts')
+
+    # free parameters and the full parameter vector, as in RegressionMC_batch
+    names = MyModel.param_names
+    free = RegressionMC_names(HyperParam)
+    ifree = np.array([names.index(name) for name in free])
+    P = np.zeros(len(names))
+    if 'tau' in names and 'tau' not in free:
+        P[names.index('tau')] = HyperParam['tau']
+    lb, ub = HyperParam['lb'][:, 0], HyperParam['ub'][:, 0]
+    log = np.array([name in HyperParam.get('log_params', []) for name in free])
+    if likelihood == 'negbin':
+        free = free + ['dispersion']
+        lb = np.append(lb, HyperParam.get('dispersion', [0.1, 1000.0])[0])
+        ub = np.append(ub, HyperParam.get('dispersion', [0.1, 1000.0])[1])
+        log = np.append(log, True)
+    d = len(free)
+
+    Nwalkers = HyperParam.get('Nwalkers', 4 * d)
+    Nsteps = HyperParam.get('Nsteps', 2000)
+    burn = HyperParam.get('burn', Nsteps // 2)
+    thin = HyperParam.get('thin', 1)
+    Nchains = HyperParam.get('Nchains', 1)
+    Nworkers = HyperParam.get('Nworkers', 1)
+    if Nwalkers % 2 or Nwalkers < 2 * d:
+        raise ValueError('Nwalkers must be even and at least twice the number of parameters')
+
+    # initial walkers of every ensemble (Nchains x Nwalkers x d)
+    streams = np.random.SeedSequence(HyperParam.get('seed')).spawn(Nchains + 1)
+    rng = np.random.default_rng(streams[0])
+    if p0 is None:
+        X0 = RegressionMC_x0(lb[:, None], ub[:, None], Nchains * Nwalkers, rng.integers(2 ** 32), 'uniform', log).T
+    else:
+        x0 = np.array([p0[name] for name in free[:len(ifree)]])
+        if likelihood == 'negbin':
+            # moment estimate of the size from the fit residuals
+            mu = np.maximum(MyModel.func(xdata, **p0), 1e-12)
+            excess = np.mean((ydata - mu) ** 2 - mu)
+            x0 = np.append(x0, np.mean(mu ** 2) / excess if excess > 0 else ub[-1])
+        X0 = x0 * (1 + 1e-3 * rng.standard_normal((Nchains * Nwalkers, d)))
+    X0 = np.clip(X0, lb, ub).reshape(Nchains, Nwalkers, d)
+
+    # ensembles, serially or in a worker pool
+    logpost = partial(LogPosterior_batch, xdata, ydata, kernel, P, ifree, lb, ub, likelihood, log)
+    chain_n = partial(_RegressionMC_mcmc_chain, logpost, Nsteps=Nsteps, burn=burn, thin=thin,
+                      a=HyperParam.get('a', 2.0))
+    with ProcessPoolExecutor(max_workers=Nworkers) if Nworkers > 1 else _SerialPool() as pool:
+        chains = list(pool.map(chain_n, X0, streams[1:]))
+
+    samples = np.concatenate([chain.reshape(-1, d) for chain, lp, acc in chains])
+    logp = np.concatenate([lp.ravel() for chain, lp, acc in chains])
+
+    MCMCObj = {}
+    MCMCObj['names'] = free
+    MCMCObj['samples'] = samples
+    MCMCObj['logp'] = logp
+    MCMCObj['mean'] = dict(zip(free, samples.mean(axis=0)))
+    MCMCObj['median'] = dict(zip(free, np.median(samples, axis=0)))
+    MCMCObj['map'] = dict(zip(free, samples[np.argmax(logp)]))
+    MCMCObj['acceptance'] = np.array([acc for chain, lp, acc in chains])
+    MCMCObj['kernel'] = kernel
+    MCMCObj['P'] = P
+    MCMCObj['ifree'] = ifree
+    MCMCObj['likelihood'] = likelihood
+    return MCMCObj
+
+
+def _RegressionMC_mcmc_chain(logpost, X0, seed, Nsteps, burn, thin, a):
+    #  one ensemble of RegressionMC_mcmc, with its telemetry record
+    tstart = perf_counter()
+    chain, lp, acc = EnsembleMCMC(logpost, X0, Nsteps, a=a, seed=seed)
+    if _TELEMETRY['file'] is not None:
+        telemetry_record('mcmc', wall=perf_counter() - tstart, Nwalkers=X0.shape[0],
+                         Nsteps=Nsteps, acceptance=acc.mean())
+    return chain[burn::thin], lp[burn::thin], acc
+
+
+def EnsembleMCMC(logpost, X0, Nsteps, a=2.0, seed=None):
+    #  This routine runs the affine-invariant ensemble sampler of Goodman
+    #  and Weare (stretch move). The ensemble is split in two halves, and
+    #  the walkers of a half move together, along lines through walkers
+    #  of the other half, so each step takes two vectorized evaluations
+    #  of the log-posterior.
+    #  Input:
+    #  logpost - log-posterior of a set of walkers, logpost(X) (W x d -> W),
+    #            -inf outside the support
+    #  X0      - initial walkers (W x d), W even
+    #  Nsteps  - number of steps
+    #  a       - scale of the stretch move
+    #  seed    - seed of the random generator
+    #  Output:
+    #  chain - walkers at every step (Nsteps x W x d)
+    #  lp    - their log-posterior (Nsteps x W)
+    #  acc   - acceptance fraction of every walker (W)
+    rng = np.random.default_rng(seed)
+    X = np.array(X0, dtype=np.float64)
+    W, d = X.shape
+    lp = logpost(X)
+    chain = np.empty((Nsteps, W, d))
+    lps = np.empty((Nsteps, W))
+    acc = np.zeros(W)
+    halves = (np.arange(0, W // 2), np.arange(W // 2, W))
+    for step in range(0, Nsteps):
+        for S, C in (halves, halves[::-1]):
+            # stretch factors with density proportional to 1/sqrt(z) on [1/a, a]
+            z = ((a - 1) * rng.random(S.size) + 1) ** 2 / a
+            Xc = X[C[rng.integers(0, C.size, S.size)]]
+            Y = Xc + z[:, None] * (X[S] - Xc)
+            lpY = logpost(Y)
+            with np.errstate(invalid='ignore'):
+                accept = np.log(rng.random(S.size)) < (d - 1) * np.log(z) + lpY - lp[S]
+            X[S[accept]] = Y[accept]
+            lp[S[accept]] = lpY[accept]
+            acc[S] += accept
+        chain[step] = X
+        lps[step] = lp
+    return chain, lps, acc / Nsteps
+
+
+def LogPosterior_batch(x, y, kernel, P, ifree, lb, ub, likelihood, log, X):
+    #  This routine evaluates the log-posterior of RegressionMC_mcmc for a
+    #  set of walkers at once, with the model values of all of them
+    #  computed in one (walkers x time) batch.
+    #  Input:
+    #  x, y       - independent parameter data and counts (T)
+    #  kernel     - batch kernel of the model
+    #  P          - full parameter vector, fixed values included
+    #  ifree      - indices of the free parameters in P
+    #  lb, ub     - bounds of the sampled parameters (d)
+    #  likelihood - 'poisson' or 'negbin' (size in the last column of X)
+    #  log        - mask of the parameters with a log-uniform prior (d)
+    #  X          - walkers (W x d)
+    #  Output:
+    #  lp - log-posterior (W), -inf outside the bounds
+    lp = np.full(X.shape[0], -np.inf)
+    inside = np.all((X >= lb) & (X <= ub), axis=1)
+    if not np.any(inside):
+        return lp
+    Xi = X[inside]
+    Pw = np.tile(P, (Xi.shape[0], 1))
+    Pw[:, ifree] = Xi[:, :len(ifree)]
+    mu, J = kernel(x, Pw, jac=False)
+    mu = np.maximum(mu, 1e-12)
+    if likelihood == 'poisson':
+        ll = np.sum(y * np.log(mu) - mu, axis=1) - np.sum(gammaln(y + 1))
+    else:
+        k = Xi[:, -1:]
+        ll = np.sum(gammaln(y + k) - gammaln(k) - gammaln(y + 1) +
+                    k * np.log(k / (k + mu)) + y * np.log(mu / (k + mu)), axis=1)
+    lp[inside] = ll - np.sum(np.log(Xi[:, log]), axis=1)
+    return lp
+
+
+def mcmcband(x, MCMCObj, conf=0.95, pred=True, Nsamples=1000, seed=None, chunk=256):
+    #  This routine evaluates posterior predictive bands of a Bayesian
+    #  calibration, a drop-in replacement of predband in the graph_* plots.
+    #  Input:
+    #  x        - prediction points
+    #  MCMCObj  - posterior from RegressionMC_mcmc
+    #  conf     - credible level, or a list of levels
+    #  pred     - True for predictive bands (counts drawn from the
+    #             likelihood), False for credible bands of the model
+    #  Nsamples - number of posterior samples used
+    #  seed     - seed of the random generator
+    #  chunk    - number of prediction points evaluated at once
+    #  Output:
+    #  lpb, upb - lower and upper band (T), or (levels x T) for a list of
+    #             credible levels
+    x = np.asarray(x, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    samples = MCMCObj['samples']
+    samples = samples[rng.choice(len(samples), min(Nsamples, len(samples)), replace=False)]
+    ifree = MCMCObj['ifree']
+    P = np.tile(MCMCObj['P'], (len(samples), 1))
+    P[:, ifree] = samples[:, :len(ifree)]
+
+    levels = np.atleast_1d(conf)
+    alpha = 1.0 - levels  # significance
+    q = np.concatenate((alpha / 2, 1 - alpha / 2))
+    band = np.empty((len(q), x.size))
+    for i in range(0, x.size, chunk):
+        mu, J = MCMCObj['kernel'](x[i:i + chunk], P, jac=False)
+        if pred and MCMCObj['likelihood'] == 'poisson':
+            mu = rng.poisson(np.maximum(mu, 0))
+        elif pred:
+            k = samples[:, -1:]
+            mu = rng.negative_binomial(k, k / (k + np.maximum(mu, 1e-12)))
+        band[:, i:i + chunk] = np.quantile(mu, q, axis=0)
+
+    lpb, upb = band[:len(levels)], band[len(levels):]
+    if np.ndim(conf) == 0:
+        return lpb[0], upb[0]
+    return lpb, upb
+
+
 # -------------------------------------
 def LogisticPDF_model(tau):
     K = symbols('K', real=True)
@@ -158,9 +2037,27 @@ def LogisticPDF_model(tau):
     return r * K * sym.exp(-r * (t - tau)) / (1 + sym.exp(-r * (t - tau))) ** 2
 
 
-def AkaikeBIC(ModelPDF, time_train, p0):
+def AkaikeBIC(ModelPDF, time_train, p0, jac=None, jac_args=(), cache_dir=None, cache_size=64 * 2 ** 20):
+    #  This routine evaluates the Akaike and Bayesian information criteria
+    #  of a symbolic model PDF on the training window.
+    #  Input:
+    #  ModelPDF   - symbolic model PDF, a function of t and the parameters
+    #  time_train - time vector for training
+    #  p0         - initial guess for the MLE estimator
+    #  jac        - model Jacobian, jac(t, *p0, *jac_args), whose first
+    #               len(p0) columns are the derivatives with respect to p0
+    #               (optional), e.g. LogisticPDF_jac with jac_args=(tau,)
+    #               for LogisticPDF_model(tau); when given, the symbolic
+    #               gradient and Hessian are skipped
+    #  jac_args   - fixed trailing arguments of jac, such as tau
+    #  cache_dir  - directory of the on-disk cache of compiled likelihood
+    #               functions (optional); with the same model and training
+    #               window, later calls skip the symbolic work entirely
+    #  cache_size - maximum size of the cache in bytes
+    #  Output:
+    #  AIC - Akaike information criterion
+    #  BIC - Bayesian information criterion
     t = symbols('t', real=True)
-    np.seterr(divide = 'ignore')
 
     def LogLikelihood_Model_sympy(Model, t, time):
         LogLikelihood_sympy = sym.log(Model.subs({t: time[0]}))
@@ -168,41 +2065,350 @@ def AkaikeBIC(ModelPDF, time_train, p0):
             LogLikelihood_sympy = LogLikelihood_sympy + sym.log(Model.subs({t: time[id]}))
         return -LogLikelihood_sympy
 
-    def LogLikelihood_Model_numpy(Model, t, time):
-        LogLikelihood_sympy = LogLikelihood_Model_sympy(Model, t, time)
+    def LogLikelihood_Model_args(LogLikelihood_sympy):
         v = list(ordered(LogLikelihood_sympy.free_symbols))
-        return lambdify(v, LogLikelihood_sympy, 'numpy')
+        return [(v, LogLikelihood_sympy)]
 
     def LogLikelihood_numpy(x):
-        return LogLikelihood_numpy2(x[0], x[1]).astype(object)
+        return np.float64(LogLikelihood_numpy2(x[0], x[1]))
 
     def gradient_hessian_sympy(f_sympy):
         v = list(ordered(f_sympy.free_symbols))
         gradient = lambda f_sympy, v: Matrix([f_sympy]).jacobian(v)
         return gradient(f_sympy, v), hessian(f_sympy, v)
 
-    def gradient_hessian_numpy(f_sympy):
+    def gradient_hessian_args(f_sympy):
         v = list(ordered(f_sympy.free_symbols))
         [grad_sympy, hess_sympy] = gradient_hessian_sympy(f_sympy)
-        return lambdify(v, grad_sympy, 'numpy'), lambdify(v, hess_sympy, 'numpy')
+        return [(v, grad_sympy), (v, hess_sympy)]
 
     def grad_numpy(x):
-        return grad_numpy2(x[0], x[1]).astype(object)
+        return np.asarray(grad_numpy2(x[0], x[1]), dtype=np.float64).ravel()
+
+    def grad_numpy_jac(x):
+        f = Model_numpy(time_np, *x)
+        J = jac(time_np, *x, *jac_args)[:, :len(x)]
+        return -np.sum(J / f[:, None], axis=0)
+
+    # the symbolic log-likelihood is built at most once, on a cache miss
+    symbolic = {}
+
+    def LogLikelihood_sympy():
+        if 'LL' not in symbolic:
+            symbolic['LL'] = LogLikelihood_Model_sympy(ModelPDF, t, time_train)
+        return symbolic['LL']
 
-    LogLikelihood_sympy = LogLikelihood_Model_sympy(ModelPDF, t, time_train)
-    LogLikelihood_numpy2 = LogLikelihood_Model_numpy(ModelPDF, t, time_train)
-    [grad_numpy2, hess_numpy2] = gradient_hessian_numpy(LogLikelihood_sympy)
+    key = sympy_cache_key(ModelPDF, time_train)
+    [LogLikelihood_numpy2] = lambdify_cached(lambda: LogLikelihood_Model_args(LogLikelihood_sympy()),
+                                             key + '-LL', cache_dir, cache_size)
+    if jac is None:
+        [grad_numpy2, hess_numpy2] = lambdify_cached(lambda: gradient_hessian_args(LogLikelihood_sympy()),
+                                                     key + '-grad', cache_dir, cache_size)
+    else:
+        # gradient from the analytic model Jacobian
+        Model_numpy = lambdify([t] + list(ordered(ModelPDF.free_symbols - {t})), ModelPDF, 'numpy')
+        time_np = np.asarray(time_train, dtype=np.float64)
+        grad_numpy = grad_numpy_jac
+
+    # ------ method='SLSQP' ------------------------------
+    # log(0) of the symbolic model at the bounds is -inf, not an error
+    with np.errstate(divide='ignore'):
+        minimum = optimize.minimize(LogLikelihood_numpy, p0,
+                                    bounds=[[0, 1e7], [0, 1]],
+                                    method='SLSQP',
+                                    jac=grad_numpy,
+                                    #options={'maxiter':400, 'disp':True},
+                                    options={'maxiter': 400},
+                                    tol=1e-4)
+        # maximum log-likelihood value
+        LL = LogLikelihood_numpy(minimum.x)
+
+    # Akaike information criterion
+    AIC = 2 * len(p0) - 2 * LL
+
+    # Bayesian information criterion
+    BIC = len(p0) * np.log(len(time_train)) - 2 * LL
+
+    return AIC, BIC
+
+
+def sympy_cache_key(ModelPDF, time_train):
+    #  This routine defines the key of the compiled likelihood functions of
+    #  a symbolic model (fixed hyperparameters, such as tau, are part of
+    #  the expression) on a training window.
+    #  Input:
+    #  ModelPDF   - symbolic model PDF
+    #  time_train - time vector for training
+    #  Output:
+    #  key - hexadecimal digest
+    digest = hashlib.sha256()
+    digest.update(sym.srepr(ModelPDF).encode())
+    digest.update(np.ascontiguousarray(time_train, dtype=np.float64).tobytes())
+    digest.update(sym.__version__.encode())
+    return digest.hexdigest()
+
+
+def lambdify_cached(build, key, cache_dir=None, cache_size=64 * 2 ** 20):
+    #  This routine lambdifies a list of symbolic expressions, keeping the
+    #  generated source code in an on-disk cache, so that on a hit neither
+    #  the expressions nor the lambdified functions are built again.
+    #  Input:
+    #  build      - function returning a list of (arguments, expression)
+    #  key        - cache key of the list
+    #  cache_dir  - cache directory (None disables the cache)
+    #  cache_size - maximum size of the cache in bytes
+    #  Output:
+    #  list of numpy functions
+    #  Remark:
+    #  a hit executes the stored source code, so the cache directory must
+    #  be trusted. The digest of an entry only detects corruption (anyone
+    #  able to write the directory can recompute it); the protection is
+    #  that entries are executed only from a directory that, with the
+    #  entry, belongs to the user and is not writable by others (see
+    #  cache_trusted); anything else is rebuilt without being executed
+    if cache_dir is not None:
+        data = cache_load(cache_dir, key) if cache_trusted(cache_dir, key) else None
+        sources = lambdify_cache_sources(data, key) if data is not None else None
+        if sources is not None:
+            namespace = lambdify([], 0, 'numpy').__globals__
+            funcs = []
+            for source in sources:
+                scope = dict(namespace)
+                exec(source, scope)
+                funcs.append(scope['_lambdifygenerated'])
+            return funcs
+    funcs = [lambdify(args, expr, 'numpy') for args, expr in build()]
+    if cache_dir is not None:
+        sources = [inspect.getsource(f) for f in funcs]
+        entry = {'sources': sources, 'digest': lambdify_cache_digest(key, sources)}
+        cache_save(cache_dir, key, json.dumps(entry).encode(), cache_size)
+    return funcs
+
+
+def lambdify_cache_digest(key, sources):
+    #  This routine computes the integrity digest of an entry of
+    #  lambdify_cached, binding the stored source code to its cache key
+    #  (it detects corrupted or misplaced entries, it is not a signature).
+    #  Input:
+    #  key     - cache key
+    #  sources - source code of the lambdified functions
+    #  Output:
+    #  digest - hexadecimal digest
+    digest = hashlib.sha256(key.encode())
+    for source in sources:
+        digest.update(b'\0' + source.encode())
+    return digest.hexdigest()
+
+
+def lambdify_cache_sources(data, key):
+    #  This routine checks the integrity of an entry of lambdify_cached:
+    #  it must parse, hold lambdified functions and match the digest of
+    #  its key and source.
+    #  Input:
+    #  data - entry contents (bytes)
+    #  key  - cache key
+    #  Output:
+    #  sources - source code of the lambdified functions, or None when
+    #            the entry is rejected
+    try:
+        entry = json.loads(data.decode())
+        sources = entry['sources']
+        digest = entry['digest']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if (not all(isinstance(source, str) and source.startswith('def _lambdifygenerated(')
+                for source in sources) or digest != lambdify_cache_digest(key, sources)):
+        return None
+    return sources
+
+
+def cache_trusted(cache_dir, key):
+    #  This routine tells whether an entry of an on-disk cache may be
+    #  executed: on POSIX systems the cache directory and the entry must
+    #  belong to the current user and not be writable by group or others.
+    #  Input:
+    #  cache_dir - cache directory
+    #  key       - entry key
+    #  Output:
+    #  True when the entry is trusted (or missing, which is a miss anyway)
+    if not hasattr(os, 'getuid'):
+        return True
+    for path in (cache_dir, os.path.join(cache_dir, key)):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            warnings.warn('untrusted cache entry ignored: ' + path)
+            return False
+    return True
+
+
+def cache_load(cache_dir, key):
+    #  This routine reads an entry of an on-disk cache and marks it as
+    #  recently used.
+    #  Input:
+    #  cache_dir - cache directory
+    #  key       - entry key
+    #  Output:
+    #  entry contents (bytes), or None when the entry is missing (or is
+    #  evicted meanwhile by another process sharing the cache)
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return data
+
+
+def cache_save(cache_dir, key, data, cache_size):
+    #  This routine writes an entry of an on-disk cache and evicts the
+    #  least recently used entries while the cache exceeds its size.
+    #  Input:
+    #  cache_dir  - cache directory
+    #  key        - entry key
+    #  data       - entry contents (bytes)
+    #  cache_size - maximum size of the cache in bytes
+    #  Remark:
+    #  several processes may share the cache: every writer uses its own
+    #  temporary file, and entries removed by another process are skipped;
+    #  a new cache directory is private to the user (an existing one keeps
+    #  its permissions)
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for mtime, size, name in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= cache_size or name == path:
+            break
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def LogLikelihood_logistic(time, K, r, tau, hess=True):
+    #  This routine evaluates, in closed form, the negative log-likelihood
+    #  used by AkaikeBIC, -sum(log(f(t))), for a sum f of n logistic
+    #  function derivatives, together with its gradient and Hessian.
+    #  The wave terms are combined in log-space, so nothing overflows
+    #  or underflows in the tails of the waves.
+    #  Input:
+    #  time - time vector (T)
+    #  K    - curves' maximum values (n)
+    #  r    - growth rates (n)
+    #  tau  - points of inflection (n)
+    #  hess - whether to compute the Hessian
+    #  Output:
+    #  LL   - negative log-likelihood
+    #  grad - gradient with respect to K1..Kn, r1..rn, tau1..taun (3n)
+    #  H    - Hessian with respect to the same parameters (3n x 3n)
+    t = np.asarray(time, dtype=np.float64)[:, None]
+    K = np.asarray(K, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    tau = np.asarray(tau, dtype=np.float64)
+    n = K.size
+    u = t - tau
+    z = r * u
+    a = np.abs(z)
+    h = np.tanh(0.5 * z)
+
+    # log of every wave and of their sum
+    logf_k = np.log(K) + np.log(r) - a - 2 * np.log1p(np.exp(-a))
+    logf = logsumexp(logf_k, axis=1)
+    LL = -np.sum(logf)
+
+    # share of every wave in the sum and derivatives of log(f_k)
+    w = np.exp(logf_k - logf[:, None])
+    gK = np.broadcast_to(1 / K, u.shape)
+    gr = 1 / r - u * h
+    gt = r * h
+
+    # derivatives of log(f) are the weighted derivatives of log(f_k)
+    G = np.concatenate((w * gK, w * gr, w * gt), axis=1)
+    grad = -np.sum(G, axis=0)
+    if not hess:
+        return LL, grad, None
+
+    # second derivatives of log(f_k)
+    c = 0.5 * (1 - h ** 2)
+    HKK = np.broadcast_to(-1 / K ** 2, u.shape)
+    Hrr = -1 / r ** 2 - u ** 2 * c
+    Hrt = h + r * u * c
+    Htt = -r ** 2 * c
+
+    # Hessian of log(f) = sum_k w_k*(H_k + g_k*g_k') - G*G'
+    H = G.T @ G
+    i = np.arange(n)
+    for (a1, g1), (a2, g2), Hk in (((0, gK), (0, gK), HKK),
+                                    ((1, gr), (1, gr), Hrr),
+                                    ((2, gt), (2, gt), Htt),
+                                    ((0, gK), (1, gr), 0),
+                                    ((0, gK), (2, gt), 0),
+                                    ((1, gr), (2, gt), Hrt)):
+        block = np.sum(w * (Hk + g1 * g2), axis=0)
+        H[a1 * n + i, a2 * n + i] -= block
+        if a1 != a2:
+            H[a2 * n + i, a1 * n + i] -= block
+    return LL, grad, H
+
+
+def AkaikeBIC_numpy(time_train, p0, tau=None, bounds=None):
+    #  This routine evaluates the same Akaike and Bayesian information
+    #  criteria as AkaikeBIC for the logistic models, without symbolic
+    #  computations (see LogLikelihood_logistic).
+    #  Input:
+    #  time_train - time vector for training
+    #  p0         - initial guess for the MLE estimator, [K, r] for
+    #               LogisticPDF with a fixed tau, or the flat vector
+    #               [K1..Kn, r1..rn, tau1..taun] of an n-wave model
+    #  tau        - fixed point of inflection of LogisticPDF (optional)
+    #  bounds     - bounds of the parameters in p0 (optional); by default
+    #               0 < K < 1e7 and 0 < r < 1, as in AkaikeBIC
+    #  Output:
+    #  AIC - Akaike information criterion
+    #  BIC - Bayesian information criterion
+    time_train = np.asarray(time_train, dtype=np.float64)
+    p0 = np.asarray(p0, dtype=np.float64)
+    n = 1 if tau is not None else len(p0) // 3
+    if bounds is None:
+        bounds = [[0, 1e7]] * n + [[0, 1]] * n + [[None, None]] * (len(p0) - 2 * n)
+
+    def LogLikelihood_numpy(x):
+        # the optimizer may probe K = 0 or r = 0 on the bounds
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if tau is not None:
+                LL, grad, H = LogLikelihood_logistic(time_train, x[0:1], x[1:2], [tau], hess=False)
+                return LL, grad[:2]
+            LL, grad, H = LogLikelihood_logistic(time_train, x[:n], x[n:2 * n], x[2 * n:], hess=False)
+            return LL, grad
 
     # ------ method='SLSQP' ------------------------------
     minimum = optimize.minimize(LogLikelihood_numpy, p0,
-                                bounds=[[0, 1e7], [0, 1]],
+                                bounds=bounds,
                                 method='SLSQP',
-                                jac=grad_numpy,
-                                #options={'maxiter':400, 'disp':True},
+                                jac=True,
                                 options={'maxiter': 400},
                                 tol=1e-4)
     # maximum log-likelihood value
-    LL = LogLikelihood_numpy(minimum.x)
+    LL = LogLikelihood_numpy(minimum.x)[0]
 
     # Akaike information criterion
     AIC = 2 * len(p0) - 2 * LL
@@ -213,6 +2419,311 @@ def AkaikeBIC(ModelPDF, time_train, p0):
     return AIC, BIC
 
 
+# -------------------------------------
+def load_spec(file_name):
+    #  This routine reads a declarative specification file (JSON, TOML or
+    #  YAML, by extension), such as the list of epidemic waves to fit.
+    #  Input:
+    #  file_name - specification file
+    #  Output:
+    #  spec - specification dict
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext == '.toml':
+        import tomllib
+        with open(file_name, 'rb') as f:
+            return tomllib.load(f)
+    if ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('reading ' + file_name + ' requires PyYAML')
+        with open(file_name) as f:
+            return yaml.safe_load(f)
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def detect_waves(time, Data_I, window=7, prominence=0.05, distance=28,
+                 K_bounds=(0.5, 1.5), r_bounds=(0.1, 10.0), tau_days=None):
+    #  This routine detects the epidemic waves of an incidence series and
+    #  generates the initial guesses and admissible intervals of the
+    #  multi-wave logistic model, so that no manual tuning is needed. The
+    #  peaks of the moving average are found in linear time and every
+    #  wave spans the valleys around its peak.
+    #  Input:
+    #  time       - time vector, indexed like Data_I
+    #  Data_I     - new events per day, indexed by date
+    #  window     - moving-average window in days
+    #  prominence - minimum peak prominence, as a fraction of the highest
+    #               moving-average value
+    #  distance   - minimum number of days between peaks
+    #  K_bounds   - admissible interval of K, as factors of its guess
+    #  r_bounds   - admissible interval of r, as factors of its guess
+    #  tau_days   - admissible interval of tau, in days around the peak
+    #               (default: none); tau always stays within the wave's
+    #               own segment between valleys, so the intervals of
+    #               neighbouring waves never overlap
+    #  Output:
+    #  WaveObj - dict with the number of waves n_waves, the initial
+    #            guesses K0, r0, t0, the starting dates tau_ast and the
+    #            peak dates of the waves, and the parameter names p and
+    #            bounds lb, ub (3n x 1) for RegressionMC
+    from scipy.signal import find_peaks
+    y = np.nan_to_num(Data_I.rolling(window, center=True, min_periods=1).mean().to_numpy(dtype=np.float64))
+    t = np.asarray(time, dtype=np.float64)
+
+    # peaks and the valleys between consecutive peaks
+    peaks, props = find_peaks(y, prominence=prominence * y.max(), distance=distance)
+    if peaks.size == 0:
+        raise ValueError('no epidemic wave found')
+    valleys = [peaks[i] + np.argmin(y[peaks[i]:peaks[i + 1]]) for i in range(0, peaks.size - 1)]
+    bounds = np.concatenate(([0], valleys, [y.size]))
+
+    # area (total events), maximum growth rate and inflection of every wave;
+    # the logistic derivative peaks at r*K/4
+    K0 = np.add.reduceat(y, bounds[:-1])
+    r0 = 4 * y[peaks] / K0
+    t0 = t[peaks]
+
+    # wave starts: first day above 10% of the peak after each valley
+    tau_ast = []
+    for i in range(0, peaks.size):
+        seg = y[bounds[i]:peaks[i] + 1]
+        tau_ast.append(Data_I.index[bounds[i] + np.argmax(seg > 0.1 * y[peaks[i]])])
+
+    # tau within the segment of every wave, independent of where the
+    # time vector starts
+    tau_lb, tau_ub = t[bounds[:-1]], t[bounds[1:] - 1]
+    if tau_days is not None:
+        tau_lb, tau_ub = np.maximum(tau_lb, t0 - tau_days), np.minimum(tau_ub, t0 + tau_days)
+
+    MyFunc = MultiWaveLogisticPDF(peaks.size)
+    WaveObj = {}
+    WaveObj['n_waves'] = peaks.size
+    WaveObj['K0'], WaveObj['r0'], WaveObj['t0'] = K0, r0, t0
+    WaveObj['tau_ast'] = tau_ast
+    WaveObj['peak'] = list(Data_I.index[peaks])
+    WaveObj['p'] = MyFunc.names
+    WaveObj['lb'] = np.concatenate((K_bounds[0] * K0, r_bounds[0] * r0, tau_lb)).reshape(-1, 1)
+    WaveObj['ub'] = np.concatenate((K_bounds[1] * K0, r_bounds[1] * r0, tau_ub)).reshape(-1, 1)
+    return WaveObj
+
+
+def RegressionMC_wave(Data_I, wave, HyperParam):
+    #  This routine fits LogisticPDF to one epidemic wave, following the
+    #  steps of the Main_COVID19_RegressionMC_*_wave_RJ scripts.
+    #  Input:
+    #  Data_I     - new events per day, indexed by date, of the whole dataset
+    #  wave       - wave specification, a dict with the entries
+    #               raw, train   - [start, end] dates of the raw and
+    #                              training data
+    #               exp          - [start, end] dates of the exponential
+    #                              growth phase, used to estimate r0
+    #               r0           - initial growth rate (instead of exp)
+    #               K0_factor    - K0 as a multiple of the total events
+    #                              (default: 1)
+    #               tau          - fixed point of inflection, a number or
+    #                              'tImax' for the day after the peak
+    #               tau_ast_threshold - lower band level that marks the
+    #                              starting date of the wave (default: 0)
+    #               band         - 'predband' (default), 'bootstrap' (see
+    #                              bootband), 'delta' (see deltaband) or
+    #                              'mcmc' (posterior predictive, see
+    #                              RegressionMC_mcmc and mcmcband)
+    #                              confidence envelopes
+    #               B            - number of bootstrap datasets
+    #               mcmc         - RegressionMC_mcmc entries (likelihood,
+    #                              Nsteps, Nwalkers, ...), dict
+    #  HyperParam - shared RegressionMC parameters (Ns, seed, sampler, cache_dir, ...)
+    #  Output:
+    #  WaveObj - dict with the fitted parameters, errors, information
+    #            criteria, model predictions and confidence envelopes
+    time_all = pd.Series(np.arange(1, len(Data_I) + 1), index=Data_I.index)
+    RawDataStart, RawDataEnd = wave['raw']
+    TrainDataStart, TrainDataEnd = wave['train']
+
+    # raw and training data
+    Data_I_raw = Data_I[RawDataStart:RawDataEnd]
+    Data_C_raw = np.cumsum(Data_I_raw)
+    Data_I_train = Data_I[TrainDataStart:TrainDataEnd]
+    time = time_all[RawDataStart:RawDataEnd]
+    time_train = time[TrainDataStart:TrainDataEnd]
+    tImax = time[Data_I_raw.idxmax()] + 1
+
+    # initial guess heuristics
+    K0 = wave.get('K0_factor', 1.0) * max(Data_C_raw)
+    if 'r0' in wave:
+        r0 = wave['r0']
+    else:
+        ExpDataStart, ExpDataEnd = wave['exp']
+        r0, B = np.polyfit(time[ExpDataStart:ExpDataEnd], np.log(Data_I_raw[ExpDataStart:ExpDataEnd]), 1)
+    tau = tImax if wave['tau'] == 'tImax' else wave['tau']
+
+    HyperParam = dict(HyperParam)
+    HyperParam['tau'] = tau
+    HyperParam['ub'] = np.array([[1.5*K0],
+                                 [10.0*r0]], dtype=np.float64)
+    HyperParam['lb'] = np.array([[0.5*K0],
+                                 [0.10*r0]], dtype=np.float64)
+
+    # incidence curve fitting and information criteria
+    case_name = wave.get('case_name')
+    with telemetry_stage('RegressionMC', case_name=case_name):
+        Result_I, ErrorObj_I = RegressionMC(time_train, Data_I_train, Model(LogisticPDF), HyperParam)
+    K_best = Result_I.best_values['K']
+    r_best = Result_I.best_values['r']
+    if 'AIC' in ErrorObj_I:
+        AIC, BIC = ErrorObj_I['AIC'], ErrorObj_I['BIC']
+    else:
+        with telemetry_stage('AkaikeBIC', case_name=case_name):
+            [AIC, BIC] = AkaikeBIC_numpy(time_train, np.array([K_best, r_best]), tau=tau)
+        if 'cache_key' in ErrorObj_I:
+            # keep the information criteria with the stored fit
+            ErrorObj_I['AIC'], ErrorObj_I['BIC'] = AIC, BIC
+            RegressionMC_cache_save(HyperParam['cache_dir'], ErrorObj_I['cache_key'], Result_I, ErrorObj_I,
+                                    HyperParam.get('cache_size', 64 * 2 ** 20))
+
+    # model predictions and confidence envelopes
+    p = np.array([K_best, r_best, tau])
+    with telemetry_stage('band', case_name=case_name, band=wave.get('band', 'predband')):
+        if wave.get('band', 'predband') == 'bootstrap':
+            I_lower, I_upper = bootband(time, time_train, Data_I_train, p, LogisticPDF, conf=0.95,
+                                        B=wave.get('B', 1000), ifree=[0, 1], seed=HyperParam.get('seed'))
+        elif wave.get('band', 'predband') == 'delta':
+            I_lower, I_upper = deltaband(time, deltaband_setup(Result_I), conf=0.95)
+        elif wave.get('band', 'predband') == 'mcmc':
+            MCMCObj = RegressionMC_mcmc(time_train, Data_I_train, Model(LogisticPDF),
+                                        dict(HyperParam, **wave.get('mcmc', {})), p0=Result_I.best_values)
+            I_lower, I_upper = mcmcband(time, MCMCObj, conf=0.95, seed=HyperParam.get('seed'))
+        else:
+            I_lower, I_upper = predband(time, time_train, Data_I_train, p, LogisticPDF, conf=0.95)
+    tau_ast = np.where(I_lower > wave.get('tau_ast_threshold', 0))[0]
+
+    WaveObj = {}
+    WaveObj['K'] = K_best
+    WaveObj['r'] = r_best
+    WaveObj['tau'] = tau
+    WaveObj['rmse'] = ErrorObj_I['rmse']
+    WaveObj['rsquare'] = ErrorObj_I['rsquare']
+    WaveObj['AIC'] = AIC
+    WaveObj['BIC'] = BIC
+    WaveObj['date'] = Data_I_raw.index
+    WaveObj['I_pred'] = LogisticPDF(np.asarray(time), K_best, r_best, tau)
+    WaveObj['C_pred'] = LogisticCDF(np.asarray(time), K_best, r_best, tau)
+    WaveObj['I_lower'], WaveObj['I_upper'] = I_lower, I_upper
+    WaveObj['C_lower'], WaveObj['C_upper'] = np.cumsum(I_lower), np.cumsum(I_upper)
+    WaveObj['tau_ast'] = Data_I_raw.index[tau_ast[0]] if tau_ast.size > 0 else None
+    return WaveObj
+
+
+# -------------------------------------
+#  Figure rendering state: interactive (a new figure per graph and
+#  plt.show) or headless (no display, one figure reused by every graph)
+_GRAPH = {'headless': False, 'formats': ('png',), 'pdf': None, 'fig': None}
+
+
+def graph_setup(headless=None, formats=None, pdf=None):
+    #  This routine configures how the graph_* functions render.
+    #  Input:
+    #  headless - True to switch to the non-interactive Agg backend; the
+    #             graphs then never call plt.show and reuse a single figure
+    #  formats  - file formats written for every graph, e.g. ('png', 'svg')
+    #  pdf      - open PdfPages object that collects every graph as a page
+    #             (False to stop collecting)
+    if headless is not None:
+        if headless:
+            plt.switch_backend('Agg')
+        elif _GRAPH['fig'] is not None:
+            plt.close(_GRAPH['fig'])
+            _GRAPH['fig'] = None
+        _GRAPH['headless'] = headless
+    if formats is not None:
+        _GRAPH['formats'] = tuple(formats)
+    if pdf is not None:
+        _GRAPH['pdf'] = pdf or None
+    return
+
+
+def graph_figure():
+    #  This routine returns the figure and axes of a new graph. In headless
+    #  mode the same figure is cleared and reused, so batch runs keep a
+    #  bounded memory footprint.
+    if _GRAPH['headless']:
+        fig = _GRAPH['fig']
+        if fig is None or not plt.fignum_exists(fig.number):
+            fig = plt.figure(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
+            _GRAPH['fig'] = fig
+        fig.clf()
+        host = fig.add_subplot()
+    else:
+        fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
+    fig.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    return fig, host
+
+
+def graph_finish(fig, graphobj):
+    #  This routine saves a graph in every configured format (or in
+    #  graphobj['formats'], if given), adds it to the open PDF, if any,
+    #  and shows it in interactive mode.
+    fig.tight_layout()
+    for fmt in graphobj.get('formats', _GRAPH['formats']):
+        fig.savefig(graphobj['gname'] + "_py." + fmt)
+    if _GRAPH['pdf'] is not None:
+        _GRAPH['pdf'].savefig(fig)
+    if not _GRAPH['headless']:
+        plt.show()
+    return
+
+
+def graph_render(specs, Nworkers=1, formats=None, pdf_file=None):
+    #  This routine renders a batch of graphs headless, spread over
+    #  Nworkers processes. Every worker reuses one figure for all its
+    #  graphs.
+    #  Input:
+    #  specs    - list of (graph function, tuple of its arguments), e.g.
+    #             (graph_I_1w, (date, yraw, yMA, yupp, ylow, ypred, graphobj))
+    #  Nworkers - number of worker processes
+    #  formats  - file formats written for every graph (default: png)
+    #  pdf_file - multi-page PDF that collects all graphs, in specs order
+    #  Output:
+    #  files - names of the files written for every graph
+    from matplotlib.backends.backend_pdf import PdfPages
+    import pickle
+
+    formats = tuple(formats) if formats is not None else _GRAPH['formats']
+    state = (_GRAPH['headless'], _GRAPH['formats'], plt.get_backend())
+    render = partial(_graph_render_spec, formats=formats, keep=pdf_file is not None)
+    specs = list(specs)
+    chunksize = max(1, len(specs) // (4 * Nworkers))
+    with ProcessPoolExecutor(max_workers=Nworkers) if Nworkers > 1 else _SerialPool() as pool:
+        pages = list(pool.map(render, specs, chunksize=chunksize))
+    if Nworkers <= 1:
+        # serial rendering ran in this process: restore the previous mode
+        graph_setup(headless=state[0], formats=state[1])
+        if not state[0]:
+            plt.switch_backend(state[2])
+
+    if pdf_file is not None:
+        with PdfPages(pdf_file) as pdf:
+            for page in pages:
+                fig = pickle.loads(page)
+                pdf.savefig(fig)
+                plt.close(fig)
+
+    return [[spec[1][-1]['gname'] + "_py." + fmt for fmt in formats] for spec in specs]
+
+
+def _graph_render_spec(spec, formats, keep=False):
+    #  This routine renders one graph spec headless; with keep, the
+    #  pickled figure is returned for the multi-page PDF.
+    import pickle
+
+    graph_setup(headless=True, formats=formats)
+    func, args = spec
+    func(*args)
+    return pickle.dumps(_GRAPH['fig']) if keep else None
+
+
 def set_xmargin(ax, left=0.0, right=0.3):
     ax.set_xmargin(0)
     ax.autoscale_view()
@@ -225,8 +2736,7 @@ def set_xmargin(ax, left=0.0, right=0.3):
 
 def graph_C_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
     deregister_matplotlib_converters()
-    fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
-    plt.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    fig, host = graph_figure()
     host.grid(True, which="both", ls="-")
     host.scatter(date, yraw, color="m", s=12, label=graphobj['leg1'])
     host.plot(date, yraw, color="m", linewidth=1)
@@ -235,7 +2745,7 @@ def graph_C_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
     host.fill_between(date, yupp, ylow, alpha=0.3, color='gray', label=graphobj['leg4'])
     host.set_ylim((graphobj['ymin'], graphobj['ymax']))
     host.set_yticks(np.arange(graphobj['ymin'], graphobj['ymax'] + .1, graphobj['ymax'] / 10))
-    plt.ylabel(graphobj['ylab'], fontsize=14)
+    host.set_ylabel(graphobj['ylab'], fontsize=14)
     host.xaxis.set_major_formatter(mdates.DateFormatter('%b%Y'))
     host.xaxis.set_major_locator(mdates.MonthLocator(interval=1))
     set_xmargin(host, left=0, right=0)
@@ -246,16 +2756,13 @@ def graph_C_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
                          frameon=True)
     legend.get_title().set_fontsize('10')
     legend._legend_box.align = "left"
-    plt.tight_layout()
-    fig.savefig(graphobj['gname'] + "_py.png")
-    plt.show()
+    graph_finish(fig, graphobj)
     return
 
 
 def graph_I_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
     deregister_matplotlib_converters()
-    fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
-    plt.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    fig, host = graph_figure()
     host.grid(True, which="both", ls="-")
     host.scatter(date, yraw, color="m", s=12, label=graphobj['leg1'])
     host.plot(date, yraw, color="m", linewidth=1)
@@ -270,7 +2777,7 @@ def graph_I_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
               color='k',
               bbox=dict(facecolor='white', edgecolor='none', pad=2))
     host.set_ylim((graphobj['ymin'], graphobj['ymax']))
-    plt.ylabel(graphobj['ylab'], fontsize=14)
+    host.set_ylabel(graphobj['ylab'], fontsize=14)
     host.xaxis.set_major_formatter(mdates.DateFormatter('%b%Y'))
     host.xaxis.set_major_locator(mdates.MonthLocator(interval=1))
     set_xmargin(host, left=0, right=0)
@@ -281,16 +2788,13 @@ def graph_I_1w(date, yraw, yMA, yupp, ylow, ypred, graphobj):
                          frameon=True)
     legend.get_title().set_fontsize('10')
     legend._legend_box.align = "left"
-    plt.tight_layout()
-    fig.savefig(graphobj['gname'] + "_py.png")
-    plt.show()
+    graph_finish(fig, graphobj)
     return
 
 
 def graph_I_6w(date, yraw, yMA, yupp, ylow, ypred, tau_ast, graphobj):
     deregister_matplotlib_converters()
-    fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
-    plt.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    fig, host = graph_figure()
     host.grid(True, which="both", ls="-")
     host.scatter(date, yraw, color="m", s=12, label=graphobj['leg1'])
     host.plot(date, yraw, color="m", linewidth=1)
@@ -301,7 +2805,7 @@ def graph_I_6w(date, yraw, yMA, yupp, ylow, ypred, tau_ast, graphobj):
         host.plot([date[tau_ast[i]], date[tau_ast[i]]],
               [0, .85 * graphobj['tauy'] * graphobj['ymax']], color="k", ls="--", linewidth=1.5)
     host.set_ylim((graphobj['ymin'], graphobj['ymax']))
-    plt.ylabel(graphobj['ylab'], fontsize=14)
+    host.set_ylabel(graphobj['ylab'], fontsize=14)
     host.xaxis.set_major_formatter(mdates.DateFormatter('%b%Y'))
     host.xaxis.set_major_locator(mdates.MonthLocator(interval=4))
     set_xmargin(host, left=0, right=0)
@@ -312,21 +2816,18 @@ def graph_I_6w(date, yraw, yMA, yupp, ylow, ypred, tau_ast, graphobj):
                          frameon=True)
     legend.get_title().set_fontsize('10')
     legend._legend_box.align = "left"
-    plt.tight_layout()
-    fig.savefig(graphobj['gname'] + "_py.png")
-    plt.show()
+    graph_finish(fig, graphobj)
     return
 
 def graph_I_raw(date, yraw, yMA, graphobj):
     deregister_matplotlib_converters()
-    fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
-    plt.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    fig, host = graph_figure()
     host.grid(True, which="both", ls="-")
     host.scatter(date, yraw, color="w", edgecolor="m", s=14, label=graphobj['leg1'])
     #host.plot(date, yraw, color="m", linewidth=1)
     host.plot(date, yMA, color="g", linewidth=2, label=graphobj['leg2'])
     host.set_ylim((graphobj['ymin'], graphobj['ymax']))
-    plt.ylabel(graphobj['ylab'], fontsize=14)
+    host.set_ylabel(graphobj['ylab'], fontsize=14)
     host.xaxis.set_major_formatter(mdates.DateFormatter('%b%Y'))
     #host.xaxis.set_major_locator(mdates.DayLocator(bymonthday=range(1, 2), interval=1))
     host.xaxis.set_major_locator(mdates.MonthLocator(interval=4))
@@ -338,23 +2839,20 @@ def graph_I_raw(date, yraw, yMA, graphobj):
                          frameon=True)
     legend.get_title().set_fontsize('10')
     legend._legend_box.align = "left"
-    plt.tight_layout()
-    fig.savefig(graphobj['gname'] + "_py.png")
-    plt.show()
+    graph_finish(fig, graphobj)
     return
 
 def graph_I_vs_C_raw(x1, y1, x2, y2, graphobj):
     deregister_matplotlib_converters()
-    fig, host = plt.subplots(figsize=(6, 6), dpi=100, facecolor='w', edgecolor='k')
-    plt.subplots_adjust(wspace=0, hspace=0, left=0.10, right=0.99, top=0.96, bottom=0.09)
+    fig, host = graph_figure()
     host.grid(True, which="both", ls="-")
     host.scatter(x1, y1, color="w", edgecolor="m", s=14, label=graphobj['leg1'])
     host.plot(x2, y2, color="g", linewidth=2, label=graphobj['leg2'])
     host.set_xlim((graphobj['xmin'], graphobj['xmax']))
     host.set_ylim((graphobj['ymin'], graphobj['ymax']))
     set_xmargin(host, left=0, right=0)
-    plt.xlabel(graphobj['xlab'], fontsize=14)
-    plt.ylabel(graphobj['ylab'], fontsize=14)
+    host.set_xlabel(graphobj['xlab'], fontsize=14)
+    host.set_ylabel(graphobj['ylab'], fontsize=14)
     legend = host.legend(fontsize='large', loc='lower center',
                          borderpad=0.5, labelspacing=.5,
                          framealpha=1, facecolor='white',
@@ -364,7 +2862,5 @@ def graph_I_vs_C_raw(x1, y1, x2, y2, graphobj):
     legend._legend_box.align = "left"
     host.set_xscale('log')
     host.set_yscale('log')
-    plt.tight_layout()
-    fig.savefig(graphobj['gname'] + "_py.png")
-    plt.show()
+    graph_finish(fig, graphobj)
     return